@@ -0,0 +1,172 @@
+"""
+CPU time per broadcast of a 64 team ranking to 1,000 subscribers, before and after frames were serialized once.
+
+Before: the fan out as it was, replayed by LegacyTopicState and LegacyConnection below. The payload is serialized with json, decoded from
+the redis message into a str, parsed and serialized again for the topic's snapshot frame, and queued as the str on every socket. Each socket
+has a long lived writer woken by an event that wraps every send in wait_for.
+After: ConnectionController.broadcast as it is. The payload is serialized with orjson into one Frame shared by every subscriber, and the
+snapshot frame splices the payload in. Writers start when frames are queued and bound each send with a timeout scope.
+
+The deflate rows compare the compression clients could get. Before it was permessage-deflate, which the ASGI server runs on every socket
+and is emulated here by a zlib compress per send. After it is ?encoding=deflate, the frame's zlib form compressed once and shared.
+Sockets are fakes that encode text frames the way the ASGI server does, redis is left out, so the cost left is serialization,
+compression and fan out.
+
+Run from backend/: python -m benchmarks.broadcast_fanout [subscriber_count] [broadcast_count]
+"""
+import asyncio
+import json
+import sys
+import time
+import zlib
+from collections import deque
+from typing import Any, Dict, Hashable, Optional
+from src.controllers.connection_controller import ConnectionController, WebSocketConnection
+from src.controllers.topic_state import topic_name, topic_rows, SNAPSHOT_FRAME, PATCH_FRAME
+from src.utils.frames import dumps
+
+SUBSCRIPTION = ("match_rankings", 1, 1)
+
+def rankings(seed: int) -> dict:
+    return {"round_number": 1, "group_rankings": [
+        {"group_number": group_number, "team_rankings": [
+            {"team_id": group_number * 16 + i, "team_name": f"Team {group_number * 16 + i}", "position": i + 1, "points": (seed + i) % 13, "goals": (seed * i) % 29, "alternate_points": (seed + 2 * i) % 17, "registration_day_of_year": i} for i in range(16)
+        ]} for group_number in range(1, 5)
+    ]}
+
+class FakeWebSocket:
+    sent = 0
+
+    def __init__(self, per_socket_deflate: bool = False):
+        self.per_socket_deflate = per_socket_deflate
+
+    # a text frame is utf-8 encoded by the server on the way out, and compressed on this socket alone with permessage-deflate
+    async def send_text(self, text: str):
+        data = text.encode('utf-8')
+        if self.per_socket_deflate:
+            zlib.compress(data)
+        FakeWebSocket.sent += 1
+
+    async def send_bytes(self, data: bytes):
+        FakeWebSocket.sent += 1
+
+class LegacyTopicState:
+    # TopicState before frames were shared
+    def __init__(self, subscription: Hashable):
+        self.subscription = subscription
+        self.topic = topic_name(subscription)
+        self.seq = 0
+        self.rows: Dict[Any, Dict] = None
+        self.snapshot_frame: str = None
+
+    def update(self, message: str) -> Optional[str]:
+        payload = json.loads(message)
+        key, rows = topic_rows(self.subscription, payload)
+        previous = self.rows
+        if previous is not None:
+            upsert = [row for row_key, row in rows.items() if previous.get(row_key) != row]
+            delete = [row_key for row_key in previous if row_key not in rows]
+            if len(upsert) == 0 and len(delete) == 0:
+                return None
+        self.rows = rows
+        self.seq += 1
+        self.snapshot_frame = json.dumps({"type": SNAPSHOT_FRAME, "topic": self.topic, "seq": self.seq, "data": payload})
+        if previous is None:
+            return self.snapshot_frame
+        return json.dumps({"type": PATCH_FRAME, "topic": self.topic, "seq": self.seq, "key": key, "upsert": upsert, "delete": delete})
+
+class LegacyConnection:
+    # WebSocketConnection.send and _write before frames were shared, for a snapshot client keeping up
+    def __init__(self, websocket: FakeWebSocket, send_timeout: float):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.queue = deque()
+        self.has_frames = asyncio.Event()
+        self.closed = False
+        self.writer = asyncio.create_task(self._write())
+
+    def send(self, subscription: Hashable, message: str):
+        self.queue.append((subscription, message))
+        self.has_frames.set()
+
+    def close(self):
+        # the old writer could lose this cancel to wait_for and park forever, the flag and the wake up let the benchmark finish
+        self.closed = True
+        self.has_frames.set()
+        self.writer.cancel()
+
+    async def _write(self):
+        try:
+            while not self.closed:
+                if len(self.queue) == 0:
+                    self.has_frames.clear()
+                    await self.has_frames.wait()
+                    continue
+                _, message = self.queue.popleft()
+                await asyncio.wait_for(self.websocket.send_text(message), self.send_timeout)
+        except asyncio.CancelledError:
+            return
+
+async def cpu_per_broadcast(subscriber_count: int, broadcast_count: int, broadcast) -> float:
+    """
+    cpu_per_broadcast is the CPU seconds for broadcast to render a broadcast and send it to every subscriber, averaged over broadcast_count.
+    """
+    FakeWebSocket.sent = 0
+    start_time = time.process_time()
+    for seed in range(broadcast_count):
+        await broadcast(seed)
+        while FakeWebSocket.sent < subscriber_count * (seed + 1):
+            await asyncio.sleep(0)
+    return (time.process_time() - start_time) / broadcast_count
+
+async def before(subscriber_count: int, broadcast_count: int, deflate: bool) -> float:
+    send_timeout = ConnectionController.get_instance().send_timeout
+    connections = [LegacyConnection(FakeWebSocket(per_socket_deflate=deflate), send_timeout) for _ in range(subscriber_count)]
+    state = LegacyTopicState(SUBSCRIPTION)
+    await asyncio.sleep(0)
+
+    async def broadcast(seed: int):
+        # published as a str, received from redis as bytes
+        message = json.dumps(rankings(seed)).encode().decode()
+        if state.update(message) is None:
+            return
+        for connection in connections:
+            connection.send(SUBSCRIPTION, message)
+
+    try:
+        return await cpu_per_broadcast(subscriber_count, broadcast_count, broadcast)
+    finally:
+        for connection in connections:
+            connection.close()
+        await asyncio.gather(*[connection.writer for connection in connections])
+
+async def after(subscriber_count: int, broadcast_count: int, deflate: bool) -> float:
+    controller = ConnectionController.get_instance()
+    connections = [WebSocketConnection(FakeWebSocket(), controller.send_queue_size, controller.send_timeout, lambda connection: None, deflate=deflate) for _ in range(subscriber_count)]
+    controller.connections.update({connection.id: connection for connection in connections})
+    controller.active_connections[SUBSCRIPTION] = {connection.id for connection in connections}
+
+    async def broadcast(seed: int):
+        await controller.broadcast(SUBSCRIPTION, dumps(rankings(seed)))
+
+    try:
+        return await cpu_per_broadcast(subscriber_count, broadcast_count, broadcast)
+    finally:
+        for connection in connections:
+            connection.close()
+        await asyncio.gather(*[connection.writer for connection in connections if connection.writer is not None])
+        controller.connections.clear()
+        controller.active_connections.pop(SUBSCRIPTION, None)
+        controller.topics.pop(SUBSCRIPTION, None)
+
+async def main(subscriber_count: int, broadcast_count: int):
+    per_thousand = 1000 / subscriber_count
+    for deflate in (False, True):
+        before_seconds = await before(subscriber_count, broadcast_count, deflate) * per_thousand
+        after_seconds = await after(subscriber_count, broadcast_count, deflate) * per_thousand
+        label = "deflate" if deflate else "text"
+        print(f"{label:<8} before: {before_seconds * 1000:.2f} ms CPU per broadcast per 1000 subscribers")
+        print(f"{label:<8} after:  {after_seconds * 1000:.2f} ms CPU per broadcast per 1000 subscribers ({before_seconds / after_seconds:.2f}x)")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 50))
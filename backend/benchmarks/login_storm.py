@@ -0,0 +1,90 @@
+"""
+Read latency on GET /teams while a storm of logins runs, with bcrypt on the event loop vs on the bcrypt thread pool.
+
+Logins only check a password against a bcrypt hash, so the difference is where bcrypt runs.
+Reads are due every READ_INTERVAL seconds from a single client for duration seconds, first idle, then while login_concurrency clients log in continuously.
+
+Run from backend/: python -m benchmarks.login_storm [duration] [login_concurrency]
+"""
+import asyncio
+import statistics
+import sys
+import time
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from src.utils.crypto import encrypt_password, check_password, check_password_async
+
+TEAMS = [{"team_id": i, "team_name": f"Team {i}", "registration_day_of_year": i, "registration_date_ddmm": "01/01", "group_number": 1 + i % 2} for i in range(12)]
+HASHED_PASSWORD = encrypt_password("password")
+# in process requests never wait on a socket, so clients yield between requests to interleave like real arrivals would
+READ_INTERVAL = 0.01
+
+def build_app(offload: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/teams")
+    async def get_teams():
+        return JSONResponse(content=TEAMS, status_code=200)
+
+    @app.post("/sessions")
+    async def create_session():
+        if offload:
+            is_valid = await check_password_async("password", HASHED_PASSWORD)
+        else:
+            is_valid = check_password("password", HASHED_PASSWORD)
+        return JSONResponse(content={"valid": is_valid}, status_code=201)
+
+    return app
+
+def percentile(samples, fraction: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+async def read_latencies(app: FastAPI, duration: float, login_concurrency: int):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        is_storming = True
+        login_count = 0
+
+        async def login_worker():
+            nonlocal login_count
+            while is_storming:
+                await client.post("/sessions")
+                login_count += 1
+                await asyncio.sleep(0)
+
+        async def reads():
+            # latency counts from when each read was due, so time stuck behind a blocked loop is not hidden
+            latencies = []
+            start_time = time.perf_counter()
+            due_at = start_time
+            while time.perf_counter() - start_time < duration:
+                await asyncio.sleep(max(0, due_at - time.perf_counter()))
+                await client.get("/teams")
+                latencies.append(time.perf_counter() - due_at)
+                due_at += READ_INTERVAL
+            return latencies
+
+        baseline = await reads()
+        logins = [asyncio.create_task(login_worker()) for _ in range(login_concurrency)]
+        await asyncio.sleep(0.1) # let the storm start
+        start_time, start_count = time.perf_counter(), login_count
+        during = await reads()
+        logins_per_second = (login_count - start_count) / (time.perf_counter() - start_time)
+        is_storming = False
+        await asyncio.gather(*logins)
+        return baseline, during, logins_per_second
+
+def report(name: str, baseline, during, logins_per_second: float):
+    print(f"{name}")
+    print(f"  idle:        p50 {statistics.median(baseline) * 1000:7.2f} ms  p99 {percentile(baseline, 0.99) * 1000:7.2f} ms")
+    print(f"  login storm: p50 {statistics.median(during) * 1000:7.2f} ms  p99 {percentile(during, 0.99) * 1000:7.2f} ms  ({len(during)} reads, {logins_per_second:.1f} logins/s)")
+
+async def main(duration: float, login_concurrency: int):
+    report("bcrypt on the event loop", *await read_latencies(build_app(offload=False), duration, login_concurrency))
+    report("bcrypt on the thread pool", *await read_latencies(build_app(offload=True), duration, login_concurrency))
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 5,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+    ))
@@ -0,0 +1,110 @@
+"""
+Time to rank a round's standings, before and after rankings were computed as columns.
+
+Before: a TeamStandingDetailed and a TeamRank are built per team, each group is sorted with a key lambda that recomputes the points
+and ties are found by walking the TeamRank objects and recomputing the points of every neighbour.
+After: the standings stay columns, points and tie-breaks are computed over the whole round at once (with NumPy when installed)
+and TeamRank objects are only built for the response.
+
+"ranking" times the sort and tie pass alone, "total" everything from the fetched rows to the GetRankingResponse.
+Standings are random, with few distinct values so there are ties. Both implementations are checked to give the same rankings.
+
+Run from backend/: python -m benchmarks.ranking_kernel [team_count] [group_count]
+"""
+import random
+import sys
+import time
+from typing import Dict, List
+from src.schemas.rank import TeamRank, GroupRanking, GetRankingResponse, TeamStandingDetailed
+from src.utils.date_util import day_of_year_to_ddmm
+from src.utils.ranking import rank_standings, np
+
+QUALIFYING_COUNT = 4
+
+def standing_rows(team_count: int, group_count: int) -> List[tuple]:
+    # as fetched by get_standing_columns before it transposes them, ordered by group
+    random.seed(team_count)
+    rows = [(1 + team_id % group_count, team_id, f"Team {team_id}", random.randint(1, 20), random.randint(0, 8), random.randint(0, 3), random.randint(0, 3), random.randint(0, 3)) for team_id in range(1, team_count + 1)]
+    return sorted(rows, key=lambda row: row[0])
+
+def score(team: TeamRank) -> int:
+    return team.wins * 3 + team.draws
+
+def alternate_score(team: TeamRank) -> int:
+    return team.wins * 5 + team.draws * 3 + team.losses
+
+def legacy_team_ranks(rows: List[tuple]) -> Dict[int, List[TeamRank]]:
+    standings = [TeamStandingDetailed(group_number=row[0], team_id=row[1], team_name=row[2], registration_day_of_year=row[3], goals=row[4], wins=row[5], draws=row[6], losses=row[7]) for row in rows]
+    group_dict: Dict[int, List[TeamRank]] = {}
+    for standing in standings:
+        group_dict.setdefault(standing.group_number, []).append(TeamRank(team_id=standing.team_id, position=1, is_tied=False, team_name=standing.team_name, goals=standing.goals, wins=standing.wins, draws=standing.draws, losses=standing.losses, registration_day_of_year=standing.registration_day_of_year, registration_date_ddmm=day_of_year_to_ddmm(standing.registration_day_of_year)))
+    return group_dict
+
+def legacy_rank(group_dict: Dict[int, List[TeamRank]]):
+    # the sort and tie pass of MatchController.get_match_rankings before the ranking kernel
+    for group_number in group_dict.keys():
+        if len(group_dict[group_number]) == 0:
+            continue
+        group_dict[group_number] = sorted(group_dict[group_number], key=lambda x: (score(x), x.goals, alternate_score(x), -x.registration_day_of_year), reverse=True)
+        cur_pos = len(group_dict[group_number])
+        tie_count = 0
+        group_dict[group_number][len(group_dict[group_number])-1].position = cur_pos
+        if cur_pos <= QUALIFYING_COUNT:
+            group_dict[group_number][len(group_dict[group_number])-1].is_qualified = True
+        for i in range(len(group_dict[group_number])-2, -1, -1):
+            if score(group_dict[group_number][i]) == score(group_dict[group_number][i+1]) and group_dict[group_number][i].goals == group_dict[group_number][i+1].goals and alternate_score(group_dict[group_number][i]) == alternate_score(group_dict[group_number][i+1]) and group_dict[group_number][i].registration_day_of_year == group_dict[group_number][i+1].registration_day_of_year:
+                group_dict[group_number][i+1].is_tied = True
+                group_dict[group_number][i].is_tied = True
+                tie_count += 1
+            else:
+                group_dict[group_number][i].is_tied = False
+                cur_pos -= (1 + tie_count)
+                tie_count = 0
+            group_dict[group_number][i].position = cur_pos
+            if cur_pos <= QUALIFYING_COUNT:
+                group_dict[group_number][i].is_qualified = True
+
+def legacy_rankings(rows: List[tuple]) -> GetRankingResponse:
+    group_dict = legacy_team_ranks(rows)
+    legacy_rank(group_dict)
+    return GetRankingResponse(round_number=1, group_rankings=[GroupRanking(group_number=group_number, team_rankings=group_dict[group_number]) for group_number in group_dict.keys()])
+
+def columnar_rankings(rows: List[tuple]) -> GetRankingResponse:
+    # MatchController.get_match_rankings from its repository call on
+    group_numbers, team_ids, team_names, registration_days, goals, wins, draws, losses = list(zip(*rows))
+    order, positions, is_tied, is_qualified = rank_standings(group_numbers, goals, wins, draws, losses, registration_days, QUALIFYING_COUNT)
+    # at most 366 distinct dates
+    registration_dates_ddmm = {day: day_of_year_to_ddmm(day) for day in set(registration_days)}
+    group_rankings: List[GroupRanking] = []
+    for rank, i in enumerate(order):
+        if len(group_rankings) == 0 or group_rankings[-1].group_number != group_numbers[i]:
+            group_rankings.append(GroupRanking(group_number=group_numbers[i], team_rankings=[]))
+        group_rankings[-1].team_rankings.append(TeamRank(team_id=team_ids[i], position=positions[rank], is_tied=is_tied[rank], is_qualified=is_qualified[rank], team_name=team_names[i], goals=goals[i], wins=wins[i], draws=draws[i], losses=losses[i], registration_day_of_year=registration_days[i], registration_date_ddmm=registration_dates_ddmm[registration_days[i]]))
+    return GetRankingResponse(round_number=1, group_rankings=group_rankings)
+
+def best_of(run, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+def main(team_count: int, group_count: int):
+    rows = standing_rows(team_count, group_count)
+    if legacy_rankings(rows) != columnar_rankings(rows):
+        raise AssertionError("rankings differ between the implementations")
+    repeat = max(3, 20000 // team_count)
+    columns = list(zip(*rows))
+    legacy_groups = [legacy_team_ranks(rows) for _ in range(repeat)]
+    # the legacy pass sorts the group lists it is given, so every run gets a fresh copy built beforehand
+    before_ranking = best_of(lambda: legacy_rank(legacy_groups.pop()), repeat)
+    after_ranking = best_of(lambda: rank_standings(columns[0], columns[4], columns[5], columns[6], columns[7], columns[3], QUALIFYING_COUNT), repeat)
+    before_total = best_of(lambda: legacy_rankings(rows), repeat)
+    after_total = best_of(lambda: columnar_rankings(rows), repeat)
+    print(f"{team_count} teams in {group_count} groups, kernel: {'numpy ' + np.__version__ if np is not None else 'pure python'}")
+    print(f"ranking before: {before_ranking * 1000:.3f} ms  after: {after_ranking * 1000:.3f} ms ({before_ranking / after_ranking:.1f}x)")
+    print(f"total   before: {before_total * 1000:.3f} ms  after: {after_total * 1000:.3f} ms ({before_total / after_total:.1f}x)")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 8)
@@ -0,0 +1,58 @@
+"""
+Requests per second on GET /teams with the old BaseHTTPMiddleware session middleware vs the pure ASGI one.
+
+The route returns a fixed 12 team payload so the database is out of the picture and the middleware cost shows.
+Requests carry no session cookie, so the old middleware does no redis lookup either.
+
+Run from backend/: python -m benchmarks.session_middleware [request_count]
+"""
+import asyncio
+import contextlib
+import io
+import sys
+import time
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from src.middleware.middleware import CookieSessionMiddleware
+
+TEAMS = [{"team_id": i, "team_name": f"Team {i}", "registration_day_of_year": i, "registration_date_ddmm": "01/01", "group_number": 1 + i % 2} for i in range(12)]
+
+class LegacyCookieSessionMiddleware(BaseHTTPMiddleware):
+    # the middleware before the rewrite, minus the redis lookup that only runs with a cookie
+    async def dispatch(self, request: Request, call_next):
+        session_token = request.cookies.get("session_token")
+        print("session_token", session_token)
+        return await call_next(request)
+
+def build_app(middleware) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/teams")
+    async def get_teams():
+        return JSONResponse(content=TEAMS, status_code=200)
+
+    app.add_middleware(middleware)
+    return app
+
+async def requests_per_second(app: FastAPI, request_count: int, concurrency: int = 50) -> float:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker(count: int):
+            for _ in range(count):
+                await client.get("/teams")
+        await worker(100) # warm up
+        start_time = time.perf_counter()
+        await asyncio.gather(*[worker(request_count // concurrency) for _ in range(concurrency)])
+        return request_count / (time.perf_counter() - start_time)
+
+async def main(request_count: int):
+    # the legacy middleware prints every token, keep it off the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        before = await requests_per_second(build_app(LegacyCookieSessionMiddleware), request_count)
+        after = await requests_per_second(build_app(CookieSessionMiddleware), request_count)
+    print(f"BaseHTTPMiddleware: {before:.0f} req/s")
+    print(f"pure ASGI:          {after:.0f} req/s ({after / before:.2f}x)")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
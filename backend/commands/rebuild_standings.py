@@ -0,0 +1,40 @@
+"""
+Recomputes team_standing_tab from match_results_tab.
+
+Standings are updated in the same transaction as every match write. When the table is first added to a database that already has matches,
+the app backfills it on startup (MatchController.backfill_standings), so this is only needed to repair standings that were edited by hand. The standings are aggregated by MySQL from the match results in one statement.
+
+Run from backend/: python -m commands.rebuild_standings [--check]
+--check only lists the teams whose stored standings differ from the match results, and exits 1 if there are any.
+"""
+import asyncio
+import sys
+from src.database.database import Database
+from src.redis.client import RedisClient
+from src.controllers.match_core import MatchController
+from src.repositories.match_core import MatchRepository
+from src.redis.lock import MatchLock
+
+async def main(check: bool) -> int:
+    database = Database.get_instance()
+    redis_client = RedisClient.get_instance()
+    await database.create_tables()
+    await redis_client.connect()
+    try:
+        async with database.SessionLocal() as db:
+            match_controller = MatchController(match_repository=MatchRepository(db), match_result_lock=MatchLock(renew=True))
+            if check:
+                drift = await match_controller.get_standings_drift()
+                for round_number, stored, aggregated in drift:
+                    print(f"round {round_number} team {stored.team_id}: stored {stored.goals}/{stored.wins}/{stored.draws}/{stored.losses}, from results {aggregated.goals}/{aggregated.wins}/{aggregated.draws}/{aggregated.losses} (goals/wins/draws/losses)")
+                print(f"{len(drift)} standings differ from the match results")
+                return 1 if len(drift) > 0 else 0
+            standing_count = await match_controller.rebuild_standings()
+        print(f"rebuilt {standing_count} standings")
+        return 0
+    finally:
+        await redis_client.close()
+        await database.engine.dispose()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main("--check" in sys.argv[1:])))
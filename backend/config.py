@@ -13,9 +13,59 @@ class Settings:
         else:
             self.database_url = os.getenv("LOCAL_DATABASE_URL")
             self.redis_url = os.getenv("LOCAL_REDIS_URL")
+
+        # redis connection pool, shared by locks and session storage
+        self.redis_max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+        self.redis_pool_timeout = float(os.getenv("REDIS_POOL_TIMEOUT", "5")) # seconds to wait for a free connection
+        self.redis_socket_timeout = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+        self.redis_socket_connect_timeout = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))
+        self.redis_health_check_interval = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")) # seconds idle before a connection is pinged
+
+        # in process cache of session lookups, deletes are pushed to every worker so the ttl only bounds missed invalidations
+        self.session_cache_size = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+        self.session_cache_ttl = float(os.getenv("SESSION_CACHE_TTL", "5"))
+
+        # "redis" stores sessions in redis, "signed" issues hmac signed tokens verified without a redis lookup
+        self.session_mode = os.getenv("SESSION_MODE", "redis")
+        self.session_signing_key = os.getenv("SESSION_SIGNING_KEY")
+
+        # bcrypt runs on this many threads off the event loop, further hashes queue
+        self.password_hash_workers = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+        # logins are turned away with 429 once this many hashes are already queued on the worker
+        self.password_hash_max_queue = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+        # login token buckets, burst is the bucket size and per minute the refill rate
+        # the ip bucket is larger since players at a venue can share one address
+        self.login_rate_limit_enabled = os.getenv("LOGIN_RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.login_rate_limit_user_burst = int(os.getenv("LOGIN_RATE_LIMIT_USER_BURST", "5"))
+        self.login_rate_limit_user_per_minute = float(os.getenv("LOGIN_RATE_LIMIT_USER_PER_MINUTE", "5"))
+        self.login_rate_limit_ip_burst = int(os.getenv("LOGIN_RATE_LIMIT_IP_BURST", "50"))
+        self.login_rate_limit_ip_per_minute = float(os.getenv("LOGIN_RATE_LIMIT_IP_PER_MINUTE", "120"))
+
+        # outbound frames queued per websocket before it is downgraded to latest snapshot only, and seconds a send may take before the socket is dropped
+        self.websocket_send_queue_size = int(os.getenv("WEBSOCKET_SEND_QUEUE_SIZE", "16"))
+        self.websocket_send_timeout = float(os.getenv("WEBSOCKET_SEND_TIMEOUT", "5"))
+        # topics one multiplexed /ws connection may subscribe to at once
+        self.websocket_max_subscriptions = int(os.getenv("WEBSOCKET_MAX_SUBSCRIPTIONS", "32"))
+        # delta and multiplexed clients silent this many seconds are pinged, and closed once silent for the idle timeout
+        self.websocket_heartbeat_interval = float(os.getenv("WEBSOCKET_HEARTBEAT_INTERVAL", "20"))
+        self.websocket_idle_timeout = float(os.getenv("WEBSOCKET_IDLE_TIMEOUT", "60"))
+
+        # topics changed by writes are re-rendered and broadcast at most once per window
+        self.broadcast_debounce_seconds = float(os.getenv("BROADCAST_DEBOUNCE_SECONDS", "0.1"))
+        # "local" renders broadcasts on the writing worker, "redis_stream" queues them in a redis stream read by every worker
+        self.broadcast_dispatch = os.getenv("BROADCAST_DISPATCH", "local")
+
+        # rendered rankings and results are cached in redis per data version, seconds an unused version is kept
+        self.read_cache_enabled = os.getenv("READ_CACHE_ENABLED", "true").lower() == "true"
+        self.read_cache_ttl = int(os.getenv("READ_CACHE_TTL", "600"))
+        # entries also held in process on each worker, 0 to only use redis
+        self.read_cache_local_size = int(os.getenv("READ_CACHE_LOCAL_SIZE", "256"))
+        # seconds one worker may spend building a missing entry while the others wait for it, before they build it themselves
+        self.read_cache_flight_timeout = float(os.getenv("READ_CACHE_FLIGHT_TIMEOUT", "2"))
         
     @classmethod
     def get_instance(cls):
         if cls.instance is None:
             cls.instance = Settings()
-        return cls.instance
\ No newline at end of file
+        return cls.instance
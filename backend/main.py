@@ -6,12 +6,21 @@ from src.routers import team
 from src.routers import match_core
 from src.routers import user
 from src.routers import session
+from src.routers import live
 from src.middleware.middleware import CookieSessionMiddleware
+from src.redis.client import RedisClient
+from src.redis.pubsub import RedisSubscriber
+from src.controllers.broadcaster import Broadcaster
+from src.utils.metrics import Metrics
+from src.controllers.match_core import MatchController
+from src.repositories.match_core import MatchRepository
+from src.redis.lock import MatchLock
 import logging
+import os
 
 # Configure logging
 logging.basicConfig(
-    filename='log.txt',  # Log to log.txt file
+    filename=os.getenv("LOG_FILE", "log.txt"),  # Log to log.txt file, or LOG_FILE eg. to keep test and benchmark runs out of it
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Log format
     level=logging.INFO  # Set the logging level (e.g., DEBUG, INFO, WARNING, ERROR, CRITICAL)
 )
@@ -19,10 +28,20 @@ logging.basicConfig(
 app = FastAPI()
 
 database: Database = Database.get_instance()
+redis_client: RedisClient = RedisClient.get_instance()
 
 async def lifespan(_):
     await database.create_tables()
+    await redis_client.connect()
+    async with database.SessionLocal() as db:
+        standing_count = await MatchController(match_repository=MatchRepository(db), match_result_lock=MatchLock(renew=True)).backfill_standings()
+    if standing_count > 0:
+        logging.info(f"backfilled {standing_count} team standings from the match results")
+    await Broadcaster.get_instance().start()
     yield
+    await Broadcaster.get_instance().close()
+    await RedisSubscriber.get_instance().close()
+    await redis_client.close()
     await database.engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
@@ -30,6 +49,7 @@ app.include_router(team.team_router)
 app.include_router(match_core.match_router)
 app.include_router(user.user_router)
 app.include_router(session.session_router)
+app.include_router(live.live_router)
 app.add_middleware(CookieSessionMiddleware)
 
 
@@ -45,4 +65,8 @@ app.add_middleware(
 
 @app.get("/")
 async def health():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics():
+    return {"redis_pool": redis_client.get_stats(), **Metrics.get_instance().snapshot()}
\ No newline at end of file
@@ -10,12 +10,13 @@ from src.models.game_match import GameMatch
 from src.schemas.rank import TeamRank, GroupRanking, GetRankingResponse
 from src.utils.date_util import day_of_year_to_ddmm
 from src.redis.session import SessionStorage
-from src.redis.lock import DistributedLock
+from src.redis.lock import DistributedLock, MatchLock
+from src.redis.read_cache import ReadCache
 class DBAdminController:
     """
     DB Admin Controller class to handle admin operations on the database.
     """
-    def __init__(self, match_repository: MatchRepository, team_repository: TeamRepository, user_repository: UserRepository, session_storage: SessionStorage, match_result_lock: DistributedLock, team_lock: DistributedLock):
+    def __init__(self, match_repository: MatchRepository, team_repository: TeamRepository, user_repository: UserRepository, session_storage: SessionStorage, match_result_lock: MatchLock, team_lock: DistributedLock):
         # dependency injection
         self.match_repository = match_repository
         self.team_repository = team_repository
@@ -24,7 +25,7 @@ class DBAdminController:
         # session storage to sign out all users except admin
         self.session_storage = session_storage
 
-        # locks to prevent inconsistency with async writes
+        # locks to prevent inconsistency with async writes, match lock is left at tournament scope
         self.match_result_lock = match_result_lock
         self.team_lock = team_lock
     
@@ -54,4 +55,5 @@ class DBAdminController:
         # release lock
         await self.match_result_lock.give()
         await self.team_lock.give()
+        await ReadCache.get_instance().bump()
         return True
\ No newline at end of file
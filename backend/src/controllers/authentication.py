@@ -3,7 +3,7 @@ from fastapi import HTTPException
 from src.models.user import User
 from src.redis.lock import DistributedLock
 from src.redis.session import SessionStorage
-from src.utils.crypto import encrypt_password, check_password
+from src.utils.crypto import encrypt_password_async, check_password_async
 from src.schemas.user import UserSessionStoreValue, UserRole, SessionTokenAndUserSession
 class AuthController:
     def __init__(self, user_repository: UserRepository, session_store: SessionStorage, user_lock: DistributedLock = None):
@@ -23,7 +23,7 @@ class AuthController:
         user:User = await self.user_repository.get_user_by_username(username)
         if user is None:
             raise HTTPException(status_code=400, detail="Wrong username or password")
-        if check_password(password, user.hashed_password) is False:
+        if await check_password_async(password, user.hashed_password) is False:
             raise HTTPException(status_code=400, detail="Wrong username or password")
         user_session_store_value: UserSessionStoreValue = UserSessionStoreValue(user_id=user.user_id, user_role=user.user_role, team_id=user.team_id)
         session_token = await self.session_store.create_session(user_session_store_value)
@@ -36,7 +36,7 @@ class AuthController:
         """
         create_user creates a new user.
         """
-        hashed_password = encrypt_password(password)
+        hashed_password = await encrypt_password_async(password)
         user = User(user_name=username, hashed_password=hashed_password, user_role=role, team_id=team_id)
 
         if not await self.user_lock.get():
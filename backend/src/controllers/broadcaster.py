@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Tuple
+from config import Settings
+from src.database.database import Database
+from src.redis.client import RedisClient
+from src.controllers.connection_controller import ConnectionController
+from src.controllers.topic_state import topic_name, topic_subscription
+from src.utils.metrics import Metrics
+
+# render jobs in "redis_stream" dispatch, read by every worker through one consumer group
+BROADCAST_JOBS_STREAM = "broadcast_jobs"
+BROADCAST_JOBS_GROUP = "broadcasters"
+BROADCAST_JOBS_MAX_LENGTH = 10000
+# jobs left unacked this long by a consumer that died are taken over by another
+BROADCAST_JOBS_CLAIM_IDLE_MS = 30000
+
+class Broadcaster:
+    """
+    Renders and publishes broadcasts after writes, off the request path.
+
+    Writes mark topics dirty and return, the topic is rendered from the database by the renderer registered for its kind and published to ConnectionController.
+    Each dirty topic is rendered once per window. The first write after a quiet window goes out straight away, so a single edit is not delayed,
+    while a burst of edits costs one render per topic per window. Topics nobody is subscribed to on any worker are not rendered at all.
+
+    Dispatch is "local" by default, the worker that wrote renders on a background task.
+    With "redis_stream" the window's dirty topics are appended to a redis stream instead and rendered by whichever worker reads them,
+    so renders are spread over the workers and survive the writing worker going away.
+    """
+    instance = None
+    # topic kind -> renderer, called with a session and the rest of the topic eg. (db, round_number, group_number) for ("match_rankings", 1, 2)
+    renderers: Dict[str, Callable[..., Awaitable[bytes]]] = {}
+
+    def __init__(self, settings: Settings):
+        settings = settings.get_instance()
+        self.window = settings.broadcast_debounce_seconds
+        self.dispatch = settings.broadcast_dispatch
+        self.database = Database.get_instance()
+        self.redis_client = RedisClient.get_instance()
+        self.dirty: Dict[Hashable, float] = {} # topic -> when it was first marked dirty
+        self.flusher: asyncio.Task = None
+        self.consumer: asyncio.Task = None
+        self.consumer_name = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_flush_at = 0.0
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = Broadcaster(Settings.get_instance())
+        return cls.instance
+
+    @classmethod
+    def register_renderer(cls, kind: str, render: Callable[..., Awaitable[bytes]]):
+        cls.renderers[kind] = render
+
+    async def snapshot(self, subscription) -> bytes:
+        """
+        snapshot renders subscription's current payload, for subscribers that need it before the next broadcast.
+        """
+        parts = subscription if isinstance(subscription, tuple) else (subscription,)
+        async with self.database.SessionLocal() as db:
+            return await Broadcaster.renderers[parts[0]](db, *parts[1:])
+
+    def mark_dirty(self, subscription):
+        """
+        mark_dirty schedules subscription to be rendered and published, a no-op if it is already pending.
+        """
+        if subscription in self.dirty:
+            Metrics.get_instance().increment("broadcast_coalesced")
+        else:
+            self.dirty[subscription] = time.time()
+        Metrics.get_instance().set_gauge("broadcast_queue_depth", len(self.dirty))
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush())
+
+    async def start(self):
+        """
+        start begins reading render jobs from the stream in "redis_stream" dispatch.
+        """
+        if self.dispatch != "redis_stream" or self.consumer is not None:
+            return
+        try:
+            await self.redis_client.get_client().xgroup_create(BROADCAST_JOBS_STREAM, BROADCAST_JOBS_GROUP, id="$", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.consumer = asyncio.create_task(self._consume())
+
+    async def close(self):
+        # hand off what is still pending before shutting down
+        if self.flusher is not None and not self.flusher.done():
+            await self.flusher
+        if self.consumer is not None:
+            self.consumer.cancel()
+            try:
+                await self.consumer
+            except asyncio.CancelledError:
+                pass
+            self.consumer = None
+
+    async def _flush(self):
+        while len(self.dirty) > 0:
+            delay = self.last_flush_at + self.window - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            dirty, self.dirty = self.dirty, {}
+            self.last_flush_at = time.monotonic()
+            Metrics.get_instance().set_gauge("broadcast_queue_depth", 0)
+            if self.dispatch == "redis_stream" and await self._enqueue(dirty):
+                continue
+            await self._render(dirty)
+
+    async def _enqueue(self, dirty: Dict[Hashable, float]) -> bool:
+        try:
+            redis = self.redis_client.get_client()
+            async with redis.pipeline(transaction=False) as pipe:
+                for subscription, dirty_at in dirty.items():
+                    pipe.xadd(BROADCAST_JOBS_STREAM, {"topic": topic_name(subscription), "dirty_at": dirty_at}, maxlen=BROADCAST_JOBS_MAX_LENGTH, approximate=True)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            # render here rather than lose the broadcast
+            Metrics.get_instance().increment("broadcast_enqueue_errors")
+            logging.error(f"failed to enqueue broadcast jobs: {e}")
+            return False
+
+    async def _consume(self):
+        redis = self.redis_client.get_client()
+        last_claim_at = 0.0
+        while True:
+            try:
+                entries: List[Tuple[bytes, Dict[bytes, bytes]]] = []
+                if time.monotonic() - last_claim_at > BROADCAST_JOBS_CLAIM_IDLE_MS / 1000:
+                    last_claim_at = time.monotonic()
+                    entries.extend(await self._claim_abandoned(redis))
+                for _, stream_entries in await redis.xreadgroup(BROADCAST_JOBS_GROUP, self.consumer_name, {BROADCAST_JOBS_STREAM: ">"}, count=100, block=1000) or []:
+                    entries.extend(stream_entries)
+                if len(entries) == 0:
+                    continue
+                # jobs for the same topic in one read are rendered once, from the earliest dirty time
+                dirty: Dict[Hashable, float] = {}
+                for _, fields in entries:
+                    subscription = topic_subscription(fields[b"topic"].decode())
+                    dirty_at = float(fields[b"dirty_at"])
+                    dirty[subscription] = min(dirty.get(subscription, dirty_at), dirty_at)
+                await self._render(dirty)
+                entry_ids = [entry_id for entry_id, _ in entries]
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.xack(BROADCAST_JOBS_STREAM, BROADCAST_JOBS_GROUP, *entry_ids)
+                    pipe.xdel(BROADCAST_JOBS_STREAM, *entry_ids)
+                    pipe.xlen(BROADCAST_JOBS_STREAM)
+                    *_, stream_depth = await pipe.execute()
+                # acked jobs are deleted, so the stream length is what is still waiting
+                Metrics.get_instance().set_gauge("broadcast_stream_depth", stream_depth)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"broadcast consumer error: {e}")
+                await asyncio.sleep(1)
+
+    async def _claim_abandoned(self, redis) -> List[Tuple[bytes, Dict[bytes, bytes]]]:
+        """
+        _claim_abandoned takes over jobs left unacked for BROADCAST_JOBS_CLAIM_IDLE_MS by consumers that died.
+
+        XPENDING and XCLAIM rather than XAUTOCLAIM, which needs redis 6.2, and filtering XPENDING by idle time needs it too.
+        """
+        pending = await redis.xpending_range(BROADCAST_JOBS_STREAM, BROADCAST_JOBS_GROUP, min="-", max="+", count=100)
+        entry_ids = [job["message_id"] for job in pending if job["time_since_delivered"] >= BROADCAST_JOBS_CLAIM_IDLE_MS]
+        if len(entry_ids) == 0:
+            return []
+        claimed = await redis.xclaim(BROADCAST_JOBS_STREAM, BROADCAST_JOBS_GROUP, self.consumer_name, min_idle_time=BROADCAST_JOBS_CLAIM_IDLE_MS, message_ids=entry_ids)
+        if len(claimed) == len(entry_ids):
+            # jobs trimmed from the stream while pending come back empty, ack them so they leave the pending list
+            trimmed_ids = [entry_id for entry_id, (claimed_id, _) in zip(entry_ids, claimed) if claimed_id is None]
+            if len(trimmed_ids) > 0:
+                await redis.xack(BROADCAST_JOBS_STREAM, BROADCAST_JOBS_GROUP, *trimmed_ids)
+        return [(entry_id, fields) for entry_id, fields in claimed if entry_id is not None]
+
+    async def _render(self, dirty: Dict[Hashable, float]):
+        """
+        _render renders and publishes the subscribed topics in dirty, recording how long each waited since it was marked dirty.
+        """
+        subscribed = await ConnectionController.get_instance().subscribed_topics(dirty.keys())
+        Metrics.get_instance().increment("broadcast_skipped_unsubscribed", len(dirty) - len(subscribed))
+        if len(subscribed) == 0:
+            return
+        for subscription, dirty_at in dirty.items():
+            if subscription not in subscribed:
+                continue
+            parts = subscription if isinstance(subscription, tuple) else (subscription,)
+            render = Broadcaster.renderers.get(parts[0])
+            if render is None:
+                logging.error(f"no broadcast renderer for {subscription}")
+                continue
+            # a session per topic, one transaction across topics would keep reading the snapshot of the first
+            # and a later topic could be cached as the data of a write committed since
+            try:
+                async with self.database.SessionLocal() as db:
+                    message = await render(db, *parts[1:])
+                Metrics.get_instance().increment("broadcast_rendered")
+            except Exception as e:
+                logging.error(f"failed to render broadcast for {subscription}: {e}")
+                continue
+            await ConnectionController.get_instance().publish(subscription, message)
+            Metrics.get_instance().observe("broadcast_lag_seconds", time.time() - dirty_at)
@@ -1,26 +1,423 @@
-from fastapi import WebSocket
-from typing import List,Tuple,Dict
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+from collections import deque
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Iterable, Optional, Set, Tuple
+from config import Settings
+from src.redis.client import RedisClient
+from src.redis.pubsub import RedisSubscriber
+from src.utils.metrics import Metrics
+from src.utils.frames import Frame, dumps
+from src.controllers.topic_state import TopicState, topic_name, topic_subscription, valid_topic, RESYNC_REQUEST, SUBSCRIBE_REQUEST, UNSUBSCRIBE_REQUEST, ERROR_FRAME, PING_FRAME
+
+# broadcasts are published on BROADCAST_PREFIX + topic, eg. "broadcast:match_rankings:1:2" for ("match_rankings", 1, 2)
+BROADCAST_PREFIX = "broadcast:"
+
+def topic_channel(subscription: Hashable) -> str:
+    return BROADCAST_PREFIX + topic_name(subscription)
+
+def channel_subscription(channel: str) -> Hashable:
+    return topic_subscription(channel[len(BROADCAST_PREFIX):])
+
+# sent to idle delta and multiplexed connections, any message back counts as the pong
+PING = Frame(dumps({"type": PING_FRAME}))
+
+class WebSocketConnection:
+    """
+    A websocket with a bounded outbound queue, subscribed to one topic or, multiplexed, to any number of them.
+
+    The queue is drained by a writer task started when frames are queued, it exits once caught up, so an idle connection holds no task.
+
+    Every frame is a full snapshot of its subscription, so when a slow client lets the queue fill up it is downgraded to latest snapshot only:
+    pending frames are collapsed to the newest one per subscription and later frames replace the pending one instead of queueing.
+    It goes back to queueing once the writer catches up. A client whose send does not finish within send_timeout is dropped.
+    Delta connections are sent patches, which cannot be collapsed, so while downgraded they are sent the topic's latest snapshot frame from snapshot_for instead.
+    Multiplexed connections are sent topic state snapshot frames rather than the bare payload, so the client can tell the topics apart.
+    Deflate connections are sent each frame's shared deflated form as a binary frame.
+    """
+    # slots keep the per connection footprint down, a worker holds thousands of mostly idle spectators
+    __slots__ = ("id", "websocket", "delta", "deflate", "multiplexed", "subscriptions", "snapshot_for", "max_queue", "send_timeout", "on_close", "queue", "latest_only", "closed", "writer", "last_seen")
+    ids = itertools.count(1)
+
+    def __init__(self, websocket: WebSocket, max_queue: int, send_timeout: float, on_close: Callable[["WebSocketConnection"], None], delta: bool = False, snapshot_for: Callable[[Hashable], Optional[Frame]] = None, deflate: bool = False, multiplexed: bool = False):
+        self.id = next(WebSocketConnection.ids)
+        self.websocket = websocket
+        self.delta = delta
+        self.deflate = deflate
+        self.multiplexed = multiplexed
+        self.subscriptions: Set[Hashable] = set()
+        self.snapshot_for = snapshot_for
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.on_close = on_close
+        self.queue: Deque[Tuple[Hashable, Frame]] = deque()
+        self.latest_only = False
+        self.closed = False
+        self.writer: asyncio.Task = None
+        # when the client last sent anything, monotonic
+        self.last_seen = time.monotonic()
+
+    @property
+    def heartbeats(self) -> bool:
+        # snapshot clients are sent bare payloads, a ping frame would be taken for one
+        return self.delta or self.multiplexed
+
+    def send(self, subscription: Hashable, frame: Frame) -> bool:
+        """
+        send queues frame for the writer without waiting, returns False if the connection is closed.
+        """
+        if self.closed:
+            return False
+        if not self.latest_only and len(self.queue) >= self.max_queue:
+            self.latest_only = True
+            Metrics.get_instance().increment("websocket_slow_consumer_downgraded")
+            latest: Dict[Hashable, Frame] = {}
+            for pending_subscription, pending_frame in self.queue:
+                latest.pop(pending_subscription, None)
+                latest[pending_subscription] = pending_frame
+            Metrics.get_instance().increment("websocket_frames_coalesced", len(self.queue) - len(latest))
+            if self.delta:
+                latest = {pending_subscription: self.snapshot_for(pending_subscription) or pending_frame for pending_subscription, pending_frame in latest.items()}
+            self.queue = deque(latest.items())
+        if self.latest_only:
+            if self.delta:
+                frame = self.snapshot_for(subscription) or frame
+            for pending in self.queue:
+                if pending[0] == subscription:
+                    self.queue.remove(pending)
+                    Metrics.get_instance().increment("websocket_frames_coalesced")
+                    break
+        self.queue.append((subscription, frame))
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.create_task(self._write())
+        return True
+
+    def memory_bytes(self) -> int:
+        """
+        memory_bytes estimates what the connection holds on to, its own structures plus the frames it has queued, which other connections may share.
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.queue) + sys.getsizeof(self.subscriptions)
+        if self.writer is not None and not self.writer.done():
+            size += sys.getsizeof(self.writer) + sys.getsizeof(self.writer.get_coro().cr_frame)
+        return size + sum(len(frame.data) for _, frame in self.queue)
+
+    def close(self):
+        self.closed = True
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+    async def _write(self):
+        try:
+            while not self.closed and len(self.queue) > 0:
+                _, frame = self.queue.popleft()
+                # a timeout scope rather than wait_for, which wraps every send in a task of its own
+                async with asyncio.timeout(self.send_timeout):
+                    if self.deflate:
+                        await self.websocket.send_bytes(frame.deflated)
+                    else:
+                        await self.websocket.send_text(frame.text)
+                Metrics.get_instance().increment("websocket_frames_sent")
+            # caught up, slow or not the client gets every frame again
+            self.latest_only = False
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            # stalled past send_timeout or already gone, stop writing to it
+            Metrics.get_instance().increment("websocket_dropped")
+            logging.warning(f"dropping websocket subscriber: {e!r}")
+            try:
+                await self.websocket.close(code=1013)
+            except Exception:
+                pass
+            self.closed = True
+            self.on_close(self)
+
 
 class ConnectionController:
+    """
+    Websocket connections of this worker, keyed by connection id, and the ids subscribed to each topic.
+
+    Controllers publish() to redis and every worker with subscribers fans the message out to its own sockets, so writes on one worker reach clients on all of them.
+    A worker only listens on the channels of topics it has subscribers for, so redis knows which topics anyone is listening to, see subscribed_topics().
+
+    Delta and multiplexed clients that send nothing for heartbeat_interval are pinged, and closed once idle for idle_timeout.
+    Snapshot clients cannot be pinged in band, the server's protocol level pings (uvicorn --ws-ping-interval) close them instead.
+    """
     instance = None
-    def __init__(self):
-        self.active_connections: Dict[Tuple,List[WebSocket]] = {}
+    def __init__(self, settings: Settings):
+        settings = settings.get_instance()
+        self.redis_client = RedisClient.get_instance()
+        self.send_queue_size = settings.websocket_send_queue_size
+        self.send_timeout = settings.websocket_send_timeout
+        self.max_subscriptions = settings.websocket_max_subscriptions
+        self.heartbeat_interval = settings.websocket_heartbeat_interval
+        self.idle_timeout = settings.websocket_idle_timeout
+        self.connections: Dict[int, WebSocketConnection] = {}
+        # topic -> ids of its subscribers, a multiplexed connection is in the set of every topic it is subscribed to
+        self.active_connections: Dict[Hashable, Set[int]] = {}
+        self.subscription_count = 0
+        self.reaper: asyncio.Task = None
+        # latest snapshot and sequence number of each topic for delta and multiplexed connections
+        self.topics: Dict[Hashable, TopicState] = {}
+        # topics this worker listens to in redis, changed under channel_lock
+        self.listening: Set[Hashable] = set()
+        self.channel_lock = asyncio.Lock()
+        # unsubscribes started when a topic's last subscriber leaves, held until done so they are not garbage collected mid-flight
+        self.listening_syncs: Set[asyncio.Task] = set()
 
     @classmethod
     def get_instance(cls):
         if cls.instance is None:
-            cls.instance = ConnectionController()
+            cls.instance = ConnectionController(Settings.get_instance())
         return cls.instance
-    
-    async def connect(self, subscription, websocket: WebSocket):
+
+    async def accept(self, websocket: WebSocket, delta: bool = False, deflate: bool = False, multiplexed: bool = False) -> WebSocketConnection:
+        """
+        accept opens websocket and starts its writer, it receives nothing until it is subscribed to a topic.
+
+        Deflate connections are sent zlib compressed binary frames.
+        """
         await websocket.accept()
-        self.active_connections[subscription] = self.active_connections.get(subscription,[])
-        self.active_connections[subscription].append(websocket)
+        connection = WebSocketConnection(websocket, self.send_queue_size, self.send_timeout, self._remove, delta=delta, snapshot_for=self._snapshot_for, deflate=deflate, multiplexed=multiplexed)
+        self.connections[connection.id] = connection
+        Metrics.get_instance().set_gauge("websocket_connections", len(self.connections))
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.create_task(self._reap())
+        return connection
+
+    async def connect(self, subscription, websocket: WebSocket, delta: bool = False, load_snapshot: Callable[[], Awaitable[bytes]] = None, deflate: bool = False) -> WebSocketConnection:
+        """
+        connect accepts websocket subscribed to subscription alone.
+        """
+        connection = await self.accept(websocket, delta=delta, deflate=deflate)
+        await self.subscribe(connection, subscription, load_snapshot)
+        return connection
+
+    async def subscribe(self, connection: WebSocketConnection, subscription, load_snapshot: Callable[[], Awaitable[bytes]] = None):
+        """
+        subscribe adds subscription to connection's topics.
+
+        Delta and multiplexed connections are sent the topic's snapshot first, load_snapshot loads it when this worker has not seen the topic yet.
+        """
+        if connection.closed or subscription in connection.subscriptions:
+            return
+        connection.subscriptions.add(subscription)
+        self.active_connections.setdefault(subscription, set()).add(connection.id)
+        self.subscription_count += 1
+        Metrics.get_instance().set_gauge("websocket_subscriptions", self.subscription_count)
+        # listen before loading the snapshot so no broadcast falls in between, delta clients ignore patches until their snapshot
+        await self._sync_listening(subscription)
+        if connection.delta or connection.multiplexed:
+            if self.topics.get(subscription) is None and load_snapshot is not None:
+                message = await load_snapshot()
+                # a broadcast may have landed while loading, it is newer
+                if self.topics.get(subscription) is None:
+                    self.topics[subscription] = TopicState(subscription)
+                    self.topics[subscription].update(message)
+            if self.topics.get(subscription) is not None and subscription in connection.subscriptions:
+                connection.send(subscription, self._snapshot_for(subscription))
+
+    async def unsubscribe(self, connection: WebSocketConnection, subscription):
+        if subscription not in connection.subscriptions:
+            return
+        connection.subscriptions.discard(subscription)
+        # frames of the topic still queued are of no use to the client anymore
+        connection.queue = deque(pending for pending in connection.queue if pending[0] != subscription)
+        self._drop(subscription, connection)
+
+    async def listen(self, connection: WebSocketConnection, load_snapshot: Callable[[Hashable], Awaitable[bytes]] = None):
+        """
+        listen passes the client's messages to receive until the client disconnects or the server closes the socket, then disconnects it.
+
+        The server closes sockets itself when the writer drops a slow client or the reaper an idle one, receiving on them then raises RuntimeError.
+        """
+        try:
+            while connection.websocket.application_state == WebSocketState.CONNECTED:
+                await self.receive(connection, await connection.websocket.receive_text(), load_snapshot)
+        except WebSocketDisconnect:
+            pass
+        except RuntimeError:
+            if connection.websocket.application_state == WebSocketState.CONNECTED:
+                raise
+        finally:
+            self.disconnect(connection)
+
+    def disconnect(self, connection: WebSocketConnection):
+        connection.close()
+        self._remove(connection)
+
+    def subscriber_count(self, subscription) -> int:
+        """
+        subscriber_count is the number of websockets subscribed to subscription on this worker.
+        """
+        return len(self.active_connections.get(subscription, ()))
+
+    async def subscribed_topics(self, subscriptions: Iterable[Hashable]) -> Set[Hashable]:
+        """
+        subscribed_topics filters subscriptions down to the ones with a subscriber on any worker.
+
+        Counts come from redis, so a worker that dies stops counting with its connection. If redis cannot be asked, every topic is assumed subscribed.
+        """
+        subscriptions = list(subscriptions)
+        if len(subscriptions) == 0:
+            return set()
+        try:
+            counts = dict(await self.redis_client.get_client().pubsub_numsub(*[topic_channel(subscription) for subscription in subscriptions]))
+        except Exception as e:
+            logging.error(f"failed to count broadcast subscribers: {e}")
+            return set(subscriptions)
+        return {subscription for subscription in subscriptions if self.subscriber_count(subscription) > 0 or counts.get(topic_channel(subscription).encode(), 0) > 0}
+
+    async def receive(self, connection: WebSocketConnection, text: str, load_snapshot: Callable[[Hashable], Awaitable[bytes]] = None):
+        """
+        receive handles a message from a subscriber, a resync from a delta client that missed a patch, or a multiplexed client subscribing and unsubscribing.
+
+        load_snapshot loads the snapshot of a topic a multiplexed client subscribes to.
+        """
+        connection.last_seen = time.monotonic()
+        try:
+            request = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(request, dict):
+            return
+        if "topic" in request:
+            subscription = topic_subscription(str(request["topic"]))
+        elif len(connection.subscriptions) == 1:
+            subscription = next(iter(connection.subscriptions))
+        else:
+            return
+        request_type = request.get("type")
+        if request_type == RESYNC_REQUEST:
+            if subscription in connection.subscriptions and (connection.delta or connection.multiplexed) and self.topics.get(subscription) is not None:
+                Metrics.get_instance().increment("websocket_resyncs")
+                connection.send(subscription, self._snapshot_for(subscription))
+        elif request_type == SUBSCRIBE_REQUEST and connection.multiplexed:
+            if not valid_topic(subscription):
+                connection.send(None, self._error_frame(subscription, "unknown topic"))
+            elif subscription not in connection.subscriptions and len(connection.subscriptions) >= self.max_subscriptions:
+                connection.send(None, self._error_frame(subscription, "too many subscriptions"))
+            else:
+                await self.subscribe(connection, subscription, None if load_snapshot is None else lambda: load_snapshot(subscription))
+        elif request_type == UNSUBSCRIBE_REQUEST and connection.multiplexed:
+            await self.unsubscribe(connection, subscription)
+
+    async def publish(self, subscription, message: bytes):
+        """
+        publish sends the rendered message to the subscribers of subscription on every worker, this one included.
+        """
+        try:
+            await self.redis_client.get_client().publish(topic_channel(subscription), message)
+            Metrics.get_instance().increment("broadcast_published")
+        except Exception as e:
+            # other workers miss this one, at least serve our own subscribers
+            Metrics.get_instance().increment("broadcast_publish_errors")
+            logging.error(f"failed to publish broadcast for {subscription}: {e}")
+            await self.broadcast(subscription, message)
+
+    async def broadcast(self, subscription, message: bytes):
+        """
+        broadcast queues message on every subscriber of this worker and returns without waiting for any send.
+
+        Snapshot connections get message as is, delta connections the patch against the previous snapshot, multiplexed ones the topic's snapshot frame,
+        nobody is sent anything if it did not change. Each is one Frame shared by all the subscribers it goes to.
+        """
+        if self.subscriber_count(subscription) == 0:
+            return
+        state = self.topics.setdefault(subscription, TopicState(subscription))
+        patch = state.update(message)
+        if patch is None:
+            Metrics.get_instance().increment("broadcast_unchanged")
+            return
+        frame = Frame(message)
+        for connection_id in list(self.active_connections.get(subscription, ())):
+            connection = self.connections[connection_id]
+            if connection.delta:
+                connection.send(subscription, patch)
+            elif connection.multiplexed:
+                connection.send(subscription, state.snapshot_frame)
+            else:
+                connection.send(subscription, frame)
+
+    def _snapshot_for(self, subscription) -> Optional[Frame]:
+        state = self.topics.get(subscription)
+        return None if state is None else state.snapshot_frame
+
+    def _error_frame(self, subscription, detail: str) -> Frame:
+        return Frame(dumps({"type": ERROR_FRAME, "topic": topic_name(subscription), "detail": detail}))
+
+    async def _sync_listening(self, subscription):
+        """
+        _sync_listening listens on the topic's channel while it has subscribers on this worker, and stops once the last one leaves.
+        """
+        async with self.channel_lock:
+            channel = topic_channel(subscription)
+            try:
+                if self.subscriber_count(subscription) > 0 and subscription not in self.listening:
+                    await RedisSubscriber.get_instance().subscribe(channel, self._on_broadcast)
+                    self.listening.add(subscription)
+                elif self.subscriber_count(subscription) == 0 and subscription in self.listening:
+                    self.listening.discard(subscription)
+                    # the snapshot goes stale once broadcasts stop arriving
+                    self.topics.pop(subscription, None)
+                    await RedisSubscriber.get_instance().unsubscribe(channel)
+            except Exception as e:
+                logging.error(f"failed to update broadcast subscription for {subscription}: {e}")
+
+    def _on_listening_synced(self, sync: asyncio.Task):
+        self.listening_syncs.discard(sync)
+        if not sync.cancelled() and sync.exception() is not None:
+            logging.error(f"broadcast subscription update failed: {sync.exception()!r}")
+
+    async def _on_broadcast(self, message):
+        await self.broadcast(channel_subscription(message["channel"].decode()), message["data"])
+
+    async def _reap(self):
+        """
+        _reap pings idle heartbeat connections and closes the ones gone quiet past idle_timeout, and records connection memory, while there are connections.
+        """
+        while len(self.connections) > 0:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for connection in list(self.connections.values()):
+                if not connection.heartbeats or now - connection.last_seen < self.heartbeat_interval:
+                    continue
+                if now - connection.last_seen < self.idle_timeout:
+                    connection.send(None, PING)
+                    continue
+                Metrics.get_instance().increment("websocket_reaped")
+                logging.warning(f"closing websocket {connection.id} idle for {now - connection.last_seen:.0f}s")
+                self.disconnect(connection)
+                # ends the endpoint's receive loop, the client may never answer the close so do not wait long
+                try:
+                    async with asyncio.timeout(self.send_timeout):
+                        await connection.websocket.close(code=1001)
+                except Exception:
+                    pass
+            memory_bytes = sum(connection.memory_bytes() for connection in self.connections.values())
+            Metrics.get_instance().set_gauge("websocket_memory_bytes", memory_bytes)
+            Metrics.get_instance().set_gauge("websocket_memory_bytes_per_connection", memory_bytes / max(1, len(self.connections)))
 
-    def disconnect(self, subscription,websocket: WebSocket):
-        self.active_connections.setdefault(subscription, [])
-        self.active_connections[subscription].remove(websocket)
+    def _remove(self, connection: WebSocketConnection):
+        for subscription in connection.subscriptions:
+            self._drop(subscription, connection)
+        connection.subscriptions = set()
+        if self.connections.pop(connection.id, None) is not None:
+            Metrics.get_instance().set_gauge("websocket_connections", len(self.connections))
 
-    async def broadcast(self, subscription,message: str):
-        for connection in self.active_connections.get(subscription, []):
-            await connection.send_text(message)
\ No newline at end of file
+    def _drop(self, subscription, connection: WebSocketConnection):
+        connections = self.active_connections.get(subscription, set())
+        if connection.id in connections:
+            connections.discard(connection.id)
+            self.subscription_count -= 1
+            if len(connections) == 0:
+                self.active_connections.pop(subscription, None)
+                sync = asyncio.create_task(self._sync_listening(subscription))
+                self.listening_syncs.add(sync)
+                sync.add_done_callback(self._on_listening_synced)
+        Metrics.get_instance().set_gauge("websocket_subscriptions", self.subscription_count)
@@ -1,23 +1,28 @@
+import logging
 from src.repositories.match_core import MatchRepository
 from src.repositories.team import TeamRepository
-from src.schemas.match_results import CreateMatchResults, MatchResultDetailed, MatchResultSparse, MatchResultsConcat,MatchResultsConcatStrict,GetMatchResultsResponse
+from src.schemas.match_results import CreateMatchResults, MatchResultDetailed, MatchResultSparse, MatchResultScore, MatchResultsConcat,MatchResultsConcatStrict,GetMatchResultsResponse
 from src.models.match_results import MatchResults
 from src.models.team import Team
-from typing import List, Set, Dict
+from typing import List, Set, Dict, Iterable, Tuple
 from fastapi import HTTPException
 from src.models.game_match import GameMatch
-from src.schemas.rank import TeamRank, GroupRanking, GetRankingResponse
+from src.schemas.rank import TeamRank, GroupRanking, GetRankingResponse, TeamStandingDetailed
 from src.utils.date_util import day_of_year_to_ddmm
-import json
-from src.redis.lock import DistributedLock
-from src.controllers.connection_controller import ConnectionController
+from src.utils.standings import standing_deltas
+from src.utils.ranking import rank_standings
+from src.utils.frames import dumps
+from src.redis.lock import MatchLock
+from src.redis.read_cache import ReadCache
+from src.controllers.broadcaster import Broadcaster
+from sqlalchemy.ext.asyncio import AsyncSession
 class MatchController:
-    def __init__(self, match_repository: MatchRepository = None, team_repository: TeamRepository = None, match_result_lock: DistributedLock = None):
+    def __init__(self, match_repository: MatchRepository = None, team_repository: TeamRepository = None, match_result_lock: MatchLock = None):
         # inject repositories
         self.match_repository = match_repository
         self.team_repository = team_repository
 
-        # lock with unique lock value for instance
+        # lock with unique lock value for instance, scoped to the rounds and groups a write touches
         self.match_result_lock = match_result_lock
 
     async def create_results(self, request_match_results: List[CreateMatchResults], round_number: int) -> bool:
@@ -72,7 +77,9 @@ class MatchController:
         # get lock here
         # existing matches will be consistent
         # we also check if matches have already been played between two teams for a round
-        # this lock prevents double write        
+        # this lock prevents double write
+        # only the groups of the teams in this batch are locked, other groups and rounds can be written in parallel
+        self.match_result_lock.scope(round_number=round_number, group_numbers=set(team_name_to_group_map.values()))
         if not await self.match_result_lock.get():
             raise HTTPException(status_code=500, detail="Failed to get match result lock")
         try:
@@ -106,23 +113,13 @@ class MatchController:
                 try:
                     is_match_results_created = await self.match_repository.create_match_results(match_results)
                     if is_match_results_created:
+                        # standings move in the same transaction as the results
+                        await self.match_repository.add_to_standings(standing_deltas(added=[MatchResultScore(round_number=round_number, match_id=result.match_id, team_id=result.team_id, goals_scored=result.goals_scored) for result in match_results]))
                         await self.match_repository.commit_transaction()
                         await self.match_repository.commit_transaction()
                         await self.match_result_lock.give()
-                        connectionController = ConnectionController.get_instance()
-                        await connectionController.broadcast(
-                            ("match_rankings",round_number,1),
-                            json.dumps((await self.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=1)).dict()),
-                        )
-                        await connectionController.broadcast(
-                            ("match_rankings",round_number,2),
-                            json.dumps((await self.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=2)).dict()),
-                        )
-                        await connectionController.broadcast(
-                            ("match_results",round_number),
-                            
-                            json.dumps(GetMatchResultsResponse(match_results=(await self.get_concat_match_results(round_number))).dict())
-                        )
+                        await ReadCache.get_instance().bump(round_numbers=[round_number])
+                        self._broadcast_round(round_number, set(team_name_to_group_map.values()))
                         return True
                     else:
                         await self.match_result_lock.give()
@@ -138,87 +135,55 @@ class MatchController:
         finally:
             await self.match_result_lock.give()
     
-    async def get_match_rankings(self, qualifying_count: int, round_number: int, group_number_filter: int = None) -> GetRankingResponse:
+    def _broadcast_round(self, round_number: int, group_numbers: Iterable[int]):
         """
-        Gets match results for a given round and group number
+        _broadcast_round marks the round's results and the rankings of the groups a write touched dirty, they are rendered and pushed by the Broadcaster.
         """
-        match_results: List[MatchResultDetailed] = await self.match_repository.get_match_results_by_round(round_number, group_number_filter)
-        # convert match_result.goals scored to points for teams in the match
-        match_maker:Dict[int,MatchResultDetailed] = {}
-        # team_id -> TeamRank
-        team_rank_mapper: Dict[int, TeamRank] = {}
-        # team_id -> group_number
-        group_mapper: Dict[int, int] = {}
+        broadcaster = Broadcaster.get_instance()
+        for group_number in set(group_numbers):
+            broadcaster.mark_dirty(("match_rankings",round_number,group_number))
+        broadcaster.mark_dirty(("match_results",round_number))
+
+    @staticmethod
+    async def rankings_message(db: AsyncSession, round_number: int, group_number: int) -> bytes:
         """
-        scoring rules:
-        1. Highest total match points (3 points for win, 1 point for draw, 0 points for loss)
-        2. Highest total goals scored
-        3. Highest alternate total match points (5 points for win, 3 points for draw, 0 points for loss)
-        4. Earliest registration date
+        rankings_message renders the payload of a group's rankings, or of every group's if group_number is None. Served from the ReadCache while no write has changed it.
         """
-        # create a match maker to get the match results
-        for result in match_results:
-            if match_maker.get(result.match_id, None) is None:
-                match_maker[result.match_id] = result
-            else:
-                team_a_detail = match_maker[result.match_id]
-                team_b_detail = result
-                group_mapper.setdefault(team_a_detail.team_id, team_a_detail.group_number)
-                group_mapper.setdefault(team_b_detail.team_id, team_b_detail.group_number)
-                team_rank_mapper.setdefault(team_a_detail.team_id, TeamRank(team_id=team_a_detail.team_id, position=1, is_tied=False, team_name=team_a_detail.team_name, goals=0,wins=0, draws=0, losses=0,registration_day_of_year=team_a_detail.registration_day_of_year, registration_date_ddmm=day_of_year_to_ddmm(team_a_detail.registration_day_of_year)))
-                team_rank_mapper.setdefault(team_b_detail.team_id, TeamRank(team_id=team_b_detail.team_id, position=1, is_tied=False, team_name=team_b_detail.team_name, goals=0,wins=0, draws=0, losses=0,registration_day_of_year=team_b_detail.registration_day_of_year, registration_date_ddmm=day_of_year_to_ddmm(team_b_detail.registration_day_of_year)))
-                team_rank_mapper[team_a_detail.team_id].goals += team_a_detail.goals_scored
-                team_rank_mapper[team_b_detail.team_id].goals += team_b_detail.goals_scored
-                if team_a_detail.goals_scored > team_b_detail.goals_scored:
-                    team_rank_mapper[team_a_detail.team_id].wins += 1
-                    team_rank_mapper[team_b_detail.team_id].losses += 1
-                elif team_a_detail.goals_scored < team_b_detail.goals_scored:
-                    team_rank_mapper[team_a_detail.team_id].losses += 1
-                    team_rank_mapper[team_b_detail.team_id].wins += 1
-                else:
-                    team_rank_mapper[team_a_detail.team_id].draws += 1
-                    team_rank_mapper[team_b_detail.team_id].draws += 1
-        # split into groups then sort
-        group_dict: Dict[int, TeamRank] = {}
-        for team in team_rank_mapper.values():
-            group_dict.setdefault(group_mapper[team.team_id], []).append(team)
+        async def build() -> bytes:
+            # ends a transaction the session may have open, so the rankings are read from a snapshot taken after the cache versions were
+            await db.rollback()
+            match_controller = MatchController(match_repository=MatchRepository(db), team_repository=TeamRepository(db))
+            return dumps((await match_controller.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=group_number)).dict())
+        return await ReadCache.get_instance().get(("match_rankings",round_number,group_number), round_number, build)
+
+    @staticmethod
+    async def results_message(db: AsyncSession, round_number: int) -> bytes:
+        """
+        results_message renders the payload of a round's match results. Served from the ReadCache while no write has changed it.
+        """
+        async def build() -> bytes:
+            await db.rollback()
+            match_controller = MatchController(match_repository=MatchRepository(db), team_repository=TeamRepository(db))
+            return dumps(GetMatchResultsResponse(match_results=(await match_controller.get_concat_match_results(round_number))).dict())
+        return await ReadCache.get_instance().get(("match_results",round_number), round_number, build)
+
+    async def get_match_rankings(self, qualifying_count: int, round_number: int, group_number_filter: int = None) -> GetRankingResponse:
+        """
+        Gets match results for a given round and group number
+        """
+        # standings are kept up to date by every match write, no match history is read here
+        group_numbers, team_ids, team_names, registration_days, goals, wins, draws, losses = await self.match_repository.get_standing_columns(round_number, group_number_filter)
+        # ranked as columns, see src/utils/ranking.py for the scoring rules
+        order, positions, is_tied, is_qualified = rank_standings(group_numbers, goals, wins, draws, losses, registration_days, qualifying_count)
+        # at most 366 distinct dates
+        registration_dates_ddmm = {day: day_of_year_to_ddmm(day) for day in set(registration_days)}
+        group_rankings: List[GroupRanking] = []
+        for rank, i in enumerate(order):
+            if len(group_rankings) == 0 or group_rankings[-1].group_number != group_numbers[i]:
+                group_rankings.append(GroupRanking(group_number=group_numbers[i], team_rankings=[]))
+            group_rankings[-1].team_rankings.append(TeamRank(team_id=team_ids[i], position=positions[rank], is_tied=is_tied[rank], is_qualified=is_qualified[rank], team_name=team_names[i], goals=goals[i], wins=wins[i], draws=draws[i], losses=losses[i], registration_day_of_year=registration_days[i], registration_date_ddmm=registration_dates_ddmm[registration_days[i]]))
+        return GetRankingResponse(round_number=round_number, group_rankings=group_rankings)
 
-        # get all teams in the group, including those that did not play yet
-        all_teams = await self.team_repository.get_teams_by_group(group_number_filter)
-        for team in all_teams:
-            if team_rank_mapper.get(team.team_id, None) is None:
-                group_dict.setdefault(team.group_number, []).append(TeamRank(team_id=team.team_id, position=1, is_tied=False, team_name=team.team_name, goals=0, wins=0, draws=0, losses=0, registration_day_of_year=team.registration_day_of_year, registration_date_ddmm=day_of_year_to_ddmm(team.registration_day_of_year)))
-        for group_number in group_dict.keys():
-            if len(group_dict[group_number]) == 0:
-                continue
-            group_dict[group_number] = sorted(group_dict[group_number], key=lambda x: (self._get_score(x), x.goals, self._get_alternate_score(x), -x.registration_day_of_year), reverse=True)
-            cur_pos = len(group_dict[group_number])
-            tie_count = 0
-            group_dict[group_number][len(group_dict[group_number])-1].position = cur_pos
-            if cur_pos <= qualifying_count:
-                group_dict[group_number][len(group_dict[group_number])-1].is_qualified = True
-            for i in range(len(group_dict[group_number])-2, -1, -1):
-                if self._get_score(group_dict[group_number][i]) == self._get_score(group_dict[group_number][i+1]) and group_dict[group_number][i].goals == group_dict[group_number][i+1].goals and self._get_alternate_score(group_dict[group_number][i]) == self._get_alternate_score(group_dict[group_number][i+1]) and group_dict[group_number][i].registration_day_of_year == group_dict[group_number][i+1].registration_day_of_year:
-                    group_dict[group_number][i+1].is_tied = True
-                    group_dict[group_number][i].is_tied = True
-                    tie_count += 1
-                else:
-                    group_dict[group_number][i].is_tied = False
-                    cur_pos -= (1 + tie_count)
-                    tie_count = 0
-                group_dict[group_number][i].position = cur_pos
-                if cur_pos <= qualifying_count:
-                    group_dict[group_number][i].is_qualified = True
-                
-        
-        # return structured response
-        return GetRankingResponse(
-            round_number=round_number,
-            group_rankings=[GroupRanking(
-                group_number=group_number,
-                team_rankings=[team for team in group_dict[group_number]]
-            ) for group_number in group_dict.keys()]
-        )
     async def get_concat_match_results(self, round_number: int) -> List[MatchResultsConcatStrict]:
         match_results: List[MatchResultDetailed] = await self.match_repository.get_match_results_by_round(round_number)
         match_results_concat: Dict[int, MatchResultsConcat] = {} # match_id -> MatchResultsConcat
@@ -245,27 +210,37 @@ class MatchController:
         ) for match_id in match_results_concat.keys()]
         return match_result_concat_list
     
+    async def _get_match_group_numbers(self, round_number: int, match_id: int) -> List[int]:
+        """
+        _get_match_group_numbers gets the groups of the teams that played match_id, checking it was played in round_number.
+
+        The round number is the client's, locking and broadcasting with the wrong one would leave writes to the match unexcluded.
+        Ends the transaction the lookup started, so what the caller reads once it holds the lock is not from a snapshot taken before it,
+        which would miss a write to the match committed while waiting.
+        """
+        match_round_number, group_numbers = await self.match_repository.get_round_and_group_numbers_by_match_id(match_id)
+        await self.match_repository.rollback_transaction()
+        if match_round_number is None:
+            raise HTTPException(status_code=404, detail="Match not found")
+        if match_round_number != round_number:
+            raise HTTPException(status_code=400, detail=f"Match {match_id} was played in round {match_round_number}, not round {round_number}")
+        return group_numbers
+
     async def update_match_results_for_match_id(self, round_number: int, match_id: int, team_id: int, team_goals:int) -> bool:
+        group_numbers = await self._get_match_group_numbers(round_number, match_id)
+        self.match_result_lock.scope(round_number=round_number, group_numbers=group_numbers)
         if not await self.match_result_lock.get():
             raise HTTPException(status_code=500, detail="Failed to get match result lock")
         try:
+            old_scores: List[MatchResultScore] = await self.match_repository.get_match_scores(match_ids=[match_id])
             result = await self.match_repository.update_match_results_for_match_id(match_id, team_id,team_goals)
             if result:
+                new_scores = [score.model_copy(update={"goals_scored": team_goals}) if score.team_id == team_id else score for score in old_scores]
+                await self.match_repository.add_to_standings(standing_deltas(added=new_scores, removed=old_scores))
                 await self.match_repository.commit_transaction()
                 await self.match_result_lock.give()
-                connectionController = ConnectionController.get_instance()
-                await connectionController.broadcast(
-                    ("match_rankings",round_number,1),
-                    json.dumps((await self.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=1)).dict()),
-                )
-                await connectionController.broadcast(
-                    ("match_rankings",round_number,2),
-                    json.dumps((await self.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=2)).dict()),
-                )
-                await connectionController.broadcast(
-                    ("match_results",round_number),
-                    json.dumps(GetMatchResultsResponse(match_results=(await self.get_concat_match_results(round_number))).dict())
-                )
+                await ReadCache.get_instance().bump(round_numbers=[round_number])
+                self._broadcast_round(round_number, group_numbers)
                 return True
             else:
                 await self.match_result_lock.give()
@@ -279,26 +254,19 @@ class MatchController:
             raise HTTPException(status_code=500, detail=str(e))
         
     async def delete_match(self, round_number:int, match_id:int) -> bool:
+        group_numbers = await self._get_match_group_numbers(round_number, match_id)
+        self.match_result_lock.scope(round_number=round_number, group_numbers=group_numbers)
         if not await self.match_result_lock.get():
             raise HTTPException(status_code=500, detail="Failed to get match result lock")
         try:
+            scores: List[MatchResultScore] = await self.match_repository.get_match_scores(match_ids=[match_id])
             result = await self.match_repository.delete_match(match_id)
             if result:
+                await self.match_repository.add_to_standings(standing_deltas(removed=scores))
                 await self.match_repository.commit_transaction()
                 await self.match_result_lock.give()
-                connectionController = ConnectionController.get_instance()
-                await connectionController.broadcast(
-                    ("match_rankings",round_number,1),
-                    json.dumps((await self.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=1)).dict()),
-                )
-                await connectionController.broadcast(
-                    ("match_rankings",round_number,2),
-                    json.dumps((await self.get_match_rankings(qualifying_count=4, round_number=round_number, group_number_filter=2)).dict()),
-                )
-                await connectionController.broadcast(
-                    ("match_results",round_number),
-                    json.dumps(GetMatchResultsResponse(match_results=(await self.get_concat_match_results(round_number))).dict())
-                )
+                await ReadCache.get_instance().bump(round_numbers=[round_number])
+                self._broadcast_round(round_number, group_numbers)
                 return True
             else:
                 await self.match_result_lock.give()
@@ -311,8 +279,74 @@ class MatchController:
             await self.match_repository.rollback_transaction()
             raise HTTPException(status_code=500, detail=str(e))
     
-    def _get_score(self, team: TeamRank) -> int:
-        return team.wins * 3 + team.draws
-    
-    def _get_alternate_score(self, team: TeamRank) -> int:
-        return team.wins * 5 + team.draws * 3 + team.losses
\ No newline at end of file
+    async def rebuild_standings(self) -> int:
+        """
+        rebuild_standings recomputes every team's standings from the match results, to repair drift. Takes the match lock at tournament scope.
+
+        Returns:
+        standing_count: int: number of standings written
+        """
+        self.match_result_lock.scope()
+        if not await self.match_result_lock.get():
+            raise HTTPException(status_code=500, detail="Failed to get match result lock")
+        try:
+            standing_count = await self.match_repository.rebuild_standings()
+            await self.match_repository.commit_transaction()
+            await ReadCache.get_instance().bump()
+            return standing_count
+        except HTTPException as e:
+            await self.match_repository.rollback_transaction()
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        finally:
+            await self.match_result_lock.give()
+
+    async def backfill_standings(self) -> int:
+        """
+        backfill_standings builds the standings from the match results if there are results but no standings yet, eg. on the first start after
+        team_standing_tab was added to a deployment with matches. Rankings would read zeroes for every team until then.
+
+        Run on startup by every worker, only one builds them and the others find them built. A worker that cannot get the lock leaves it to the one holding it.
+
+        Returns:
+        standing_count: int: number of standings written, 0 if nothing was missing
+        """
+        if not await self.match_repository.is_standings_missing():
+            return 0
+        self.match_result_lock.scope()
+        if not await self.match_result_lock.get():
+            logging.warning("standings are missing but the match lock is held elsewhere, not backfilling them on this worker")
+            return 0
+        try:
+            # the standings table is read again under the lock, another worker may have filled it meanwhile
+            await self.match_repository.rollback_transaction()
+            if not await self.match_repository.is_standings_missing():
+                return 0
+            standing_count = await self.match_repository.rebuild_standings()
+            await self.match_repository.commit_transaction()
+            await ReadCache.get_instance().bump()
+            return standing_count
+        except HTTPException as e:
+            await self.match_repository.rollback_transaction()
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        finally:
+            await self.match_result_lock.give()
+
+    async def get_standings_drift(self, round_numbers: Iterable[int] = (1, 2, 3)) -> List[Tuple[int, TeamStandingDetailed, TeamStandingDetailed]]:
+        """
+        get_standings_drift compares the stored standings with ones aggregated from the match results.
+
+        Returns:
+        drift: List[Tuple[int, TeamStandingDetailed, TeamStandingDetailed]]: (round_number, stored, aggregated) for every team where they differ
+        """
+        drift = []
+        for round_number in round_numbers:
+            stored = await self.match_repository.get_standings(round_number)
+            aggregated = {standing.team_id: standing for standing in await self.match_repository.get_standings_aggregated(round_number)}
+            for standing in stored:
+                if aggregated.get(standing.team_id) != standing:
+                    drift.append((round_number, standing, aggregated.get(standing.team_id)))
+        return drift
+
+
+Broadcaster.register_renderer("match_rankings", MatchController.rankings_message)
+Broadcaster.register_renderer("match_results", MatchController.results_message)
@@ -1,22 +1,30 @@
+import logging
 from src.repositories.team import TeamRepository
 from src.schemas.team import RegisterTeamRequest, TeamDetails, TeamMatchUpDetail
 from src.models.team import Team
 from typing import List
 from fastapi import HTTPException
 from src.utils.date_util import ddmm_to_day_of_year, day_of_year_to_ddmm
-from src.redis.lock import DistributedLock
+from src.redis.lock import DistributedLock, MatchLock
 from src.schemas.team import TeamBase
-from src.controllers.connection_controller import ConnectionController
-import json
+from src.controllers.broadcaster import Broadcaster
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.utils.frames import dumps
 from fastapi.responses import JSONResponse
 from src.repositories.match_core import MatchRepository
+from src.redis.session import SessionStorage
+from src.redis.read_cache import ReadCache
+from src.utils.standings import standing_deltas
 class TeamController:
-    def __init__(self, team_repository: TeamRepository, match_repository: MatchRepository = None, team_lock: DistributedLock = None, match_lock: DistributedLock = None):
+    def __init__(self, team_repository: TeamRepository, match_repository: MatchRepository = None, team_lock: DistributedLock = None, match_lock: MatchLock = None, session_storage: SessionStorage = None):
         # inject team_repository
         self.team_repository = team_repository
         self.match_repository = match_repository
         self.team_lock = team_lock
         self.match_lock = match_lock
+
+        # session storage to sign out the users of a deleted team
+        self.session_storage = session_storage
     
     async def create_teams(self, request_teams: List[RegisterTeamRequest]) -> bool:
         """
@@ -63,13 +71,9 @@ class TeamController:
             if await self.team_repository.create_teams(teams) == True:
                 is_committed = await self.team_repository.commit_transaction()
                 await self.team_lock.give()
-                connectionController = ConnectionController.get_instance()
-                teams:List[TeamBase] = await self.get_teams()
-                response = json.dumps(sorted([team.dict() for team in teams], key=lambda x: x["group_number"]))
-                await connectionController.broadcast(
-                    ("teams"),
-                    response
-                )
+                # team names and groups show in every round's rankings and results
+                await ReadCache.get_instance().bump()
+                Broadcaster.get_instance().mark_dirty(("teams"))
                 return is_committed
             else:
                 await self.team_lock.give()
@@ -77,6 +81,14 @@ class TeamController:
         finally:
             await self.team_lock.give()
 
+    @staticmethod
+    async def teams_message(db: AsyncSession) -> bytes:
+        """
+        teams_message renders the websocket payload of the team list.
+        """
+        teams:List[TeamBase] = await TeamController(TeamRepository(db)).get_teams()
+        return dumps(sorted([team.dict() for team in teams], key=lambda x: x["group_number"]))
+
     async def get_teams(self) -> List[TeamBase]:
         """
         get_teams gets all teams from the repository.
@@ -94,23 +106,31 @@ class TeamController:
         """
         delete_team deletes a team by team_id.
         """
+        # the team's matches can be in any round, every write to them (cross group finals included) locks the team's group
+        teams: List[Team] = await self.team_repository.get_teams_by_ids([team_id])
+        self.match_lock.scope(group_numbers=[team.group_number for team in teams])
+        # the lookup started a transaction, the scores read under the locks must not come from its snapshot and miss a result committed while waiting
+        await self.team_repository.rollback_transaction()
         if not await self.team_lock.get() or not await self.match_lock.get():
             await self.team_lock.give()
             await self.match_lock.give()
             raise HTTPException(status_code=500, detail="Failed to get team lock")
         try:
-            if await self.match_repository.delete_match_results_associated_with_team(team_id) and await self.team_repository.delete_team(team_id) == True:
+            # the opponents' standings lose these matches too, the team's own go with it
+            scores = await self.match_repository.get_match_scores(team_id=team_id)
+            if await self.match_repository.delete_match_results_associated_with_team(team_id) and await self.match_repository.add_to_standings(standing_deltas(removed=scores)) and await self.team_repository.delete_team(team_id) == True:
                 await self.match_repository.commit_transaction()
                 is_committed = await self.team_repository.commit_transaction()
                 await self.team_lock.give()
                 await self.match_lock.give()
-                connectionController = ConnectionController.get_instance()
-                teams:List[TeamBase] = await self.get_teams()
-                response = json.dumps(sorted([team.dict() for team in teams], key=lambda x: x["group_number"]))
-                await connectionController.broadcast(
-                    ("teams"),
-                    response
-                )
+                await ReadCache.get_instance().bump()
+                Broadcaster.get_instance().mark_dirty(("teams"))
+                # the team's users are deleted with it (cascade), end their sessions too
+                # the delete has committed by now, a redis error here is logged rather than failing it
+                try:
+                    await self.session_storage.delete_all_sessions_for_team(team_id)
+                except Exception as e:
+                    logging.error(f"failed to end sessions of deleted team {team_id}: {e}")
                 return is_committed
             else:
                 await self.team_lock.give()
@@ -147,16 +167,14 @@ class TeamController:
             if await self.team_repository.update_team(team_id, team_name, registration_day_of_year) == True:
                 is_committed = await self.team_repository.commit_transaction()
                 await self.team_lock.give()
-                connectionController = ConnectionController.get_instance()
-                teams:List[TeamBase] = await self.get_teams()
-                response = json.dumps(sorted([team.dict() for team in teams], key=lambda x: x["group_number"]))
-                await connectionController.broadcast(
-                    ("teams"),
-                    response
-                )
+                await ReadCache.get_instance().bump()
+                Broadcaster.get_instance().mark_dirty(("teams"))
                 return is_committed
             else:
                 await self.team_lock.give()
                 return False
         finally:
-            await self.team_lock.give()
\ No newline at end of file
+            await self.team_lock.give()
+
+
+Broadcaster.register_renderer("teams", TeamController.teams_message)
@@ -0,0 +1,100 @@
+from src.utils.frames import Frame, dumps, loads
+from src.redis.lock import MATCH_LOCK_ROUNDS, MATCH_LOCK_GROUPS
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# delta protocol frames, sent to websockets that connect with ?protocol=delta
+#   {"type": "snapshot", "topic": "match_rankings:1:2", "seq": 7, "data": <the full snapshot payload>}
+#   {"type": "patch", "topic": "match_rankings:1:2", "seq": 8, "key": "team_id", "upsert": [<changed rows>], "delete": [<removed keys>]}
+# a patch applies to the state at seq - 1, a client that sees a gap sends {"type": "resync"} and gets a snapshot back
+SNAPSHOT_FRAME = "snapshot"
+PATCH_FRAME = "patch"
+RESYNC_REQUEST = "resync"
+# multiplexed connections on /ws pick their topics, {"type": "subscribe", "topic": "teams"} and {"type": "unsubscribe", "topic": "teams"}
+# requests that cannot be served are answered with {"type": "error", "topic": "teams", "detail": "unknown topic"}
+SUBSCRIBE_REQUEST = "subscribe"
+UNSUBSCRIBE_REQUEST = "unsubscribe"
+ERROR_FRAME = "error"
+# idle delta and multiplexed connections are sent {"type": "ping"} and closed if they stay silent, clients answer with {"type": "pong"}
+PING_FRAME = "ping"
+
+# topic kind -> allowed values of each part after it, eg. match_rankings:<round_number>:<group_number>
+# bounded to the tournament's rounds and groups, every topic subscribed costs a redis subscription, its state and snapshots
+TOPIC_KINDS = {"teams": (), "match_results": (MATCH_LOCK_ROUNDS,), "match_rankings": (MATCH_LOCK_ROUNDS, MATCH_LOCK_GROUPS)}
+
+def topic_name(subscription: Hashable) -> str:
+    parts = subscription if isinstance(subscription, tuple) else (subscription,)
+    return ":".join(str(part) for part in parts)
+
+def topic_subscription(topic: str) -> Hashable:
+    # inverse of topic_name
+    parts = tuple(int(part) if part.isdigit() else part for part in topic.split(":"))
+    return parts if len(parts) > 1 else parts[0]
+
+def valid_topic(subscription: Hashable) -> bool:
+    parts = subscription if isinstance(subscription, tuple) else (subscription,)
+    part_values = TOPIC_KINDS.get(parts[0])
+    return part_values is not None and len(part_values) == len(parts) - 1 and all(isinstance(part, int) and part in values for part, values in zip(parts[1:], part_values))
+
+def topic_rows(subscription: Hashable, payload: Any) -> Optional[Tuple[str, Dict[Any, Dict]]]:
+    """
+    topic_rows flattens a snapshot payload into its key field and rows by key, None for topics without a row format.
+
+    Ranking rows carry their group_number, rows are ordered client side by position, match_id or group_number.
+    """
+    kind = subscription[0] if isinstance(subscription, tuple) else subscription
+    if kind == "match_rankings":
+        return "team_id", {row["team_id"]: {**row, "group_number": group["group_number"]} for group in payload["group_rankings"] for row in group["team_rankings"]}
+    if kind == "match_results":
+        return "match_id", {row["match_id"]: row for row in payload["match_results"]}
+    if kind == "teams":
+        return "team_id", {row["team_id"]: row for row in payload}
+    return None
+
+
+class TopicState:
+    """
+    Latest snapshot of a topic on this worker, diffed against each new snapshot to build patches.
+
+    Sequence numbers are per worker, a client only ever sees the frames of the worker it is connected to.
+    """
+    def __init__(self, subscription: Hashable):
+        self.subscription = subscription
+        self.topic = topic_name(subscription)
+        self.seq = 0
+        self.rows: Dict[Any, Dict] = None
+        self.snapshot_frame: Frame = None
+
+    def update(self, message: bytes) -> Optional[Frame]:
+        """
+        update moves the topic to the snapshot in message and returns the patch frame, None if nothing changed.
+
+        Topics without a row format, or an unparseable snapshot, get the snapshot frame in place of a patch.
+        """
+        try:
+            key_rows = topic_rows(self.subscription, loads(message))
+        except (ValueError, KeyError, TypeError):
+            key_rows = None
+        if key_rows is None:
+            self.rows = None
+            self.seq += 1
+            self.snapshot_frame = self._snapshot(message)
+            return self.snapshot_frame
+        key, rows = key_rows
+        previous = self.rows
+        if previous is not None:
+            upsert = [row for row_key, row in rows.items() if previous.get(row_key) != row]
+            delete = [row_key for row_key in previous if row_key not in rows]
+            if len(upsert) == 0 and len(delete) == 0:
+                return None
+        self.rows = rows
+        self.seq += 1
+        self.snapshot_frame = self._snapshot(message)
+        if previous is None:
+            # nothing to diff against yet, clients of this worker get the snapshot
+            return self.snapshot_frame
+        return Frame.encode({"type": PATCH_FRAME, "topic": self.topic, "seq": self.seq, "key": key, "upsert": upsert, "delete": delete})
+
+    def _snapshot(self, message: bytes) -> Frame:
+        # the rendered payload is spliced in as is rather than parsed and serialized again
+        header = dumps({"type": SNAPSHOT_FRAME, "topic": self.topic, "seq": self.seq})
+        return Frame(header[:-1] + b',"data":' + message + b'}')
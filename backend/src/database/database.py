@@ -7,6 +7,7 @@ from src.models.user import User
 from src.models.team import Team
 from src.models.game_match import GameMatch
 from src.models.match_results import MatchResults
+from src.models.team_standing import TeamStanding
 
 class Database:
     instance = None
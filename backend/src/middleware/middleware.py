@@ -1,16 +1,40 @@
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection, cookie_parser
+from starlette.types import ASGIApp, Receive, Scope, Send
 from src.redis.session import SessionStorage
+from src.schemas.user import UserSessionStoreValue
 
-class CookieSessionMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        session_token = request.cookies.get("session_token")
-        print("session_token", session_token)
-        if not session_token:
-            response = await call_next(request)
-            return response
-        session_store = SessionStorage.get_instance()
-        user_session = await session_store.get_session(session_token)
-        request.state.user_session = user_session
-        response = await call_next(request)
-        return response
\ No newline at end of file
+class CookieSessionMiddleware:
+    """
+    Pure ASGI middleware that reads the session_token cookie into the connection state, for http and websocket scopes.
+
+    The session itself is only looked up by get_user_session, for routes that depend on it.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] in ("http", "websocket"):
+            session_token = None
+            for name, value in scope["headers"]:
+                if name == b"cookie":
+                    session_token = cookie_parser(value.decode("latin-1")).get("session_token")
+                    if session_token:
+                        break
+            scope.setdefault("state", {})["session_token"] = session_token
+        await self.app(scope, receive, send)
+
+async def get_user_session(connection: HTTPConnection) -> UserSessionStoreValue:
+    """
+    get_user_session resolves the session for the cookie and sets state.user_session (None if signed out).
+
+    Add it as a dependency to routes that read request.state.user_session, works for websocket routes too.
+    """
+    state = connection.state
+    if hasattr(state, "user_session"):
+        return state.user_session
+    session_token = getattr(state, "session_token", None)
+    user_session = None
+    if session_token:
+        user_session = await SessionStorage.get_instance().get_session(session_token)
+    state.user_session = user_session
+    return user_session
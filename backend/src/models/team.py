@@ -16,5 +16,6 @@ class Team(Base):
 
     users = relationship('User', back_populates='team')
     match_results = relationship('MatchResults', back_populates='team')
+    standings = relationship('TeamStanding', back_populates='team', passive_deletes=True)
 
     __table_args__ = {'mysql_engine': 'InnoDB'}
\ No newline at end of file
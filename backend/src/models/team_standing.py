@@ -0,0 +1,23 @@
+from sqlalchemy import Column, ForeignKey, Integer
+from sqlalchemy.dialects.mysql import TINYINT
+from sqlalchemy.orm import relationship
+from src.models import Base
+
+class TeamStanding(Base):
+    """
+    TeamStanding Table Model using SQLAlchemy ORM
+
+    A team's tally for a round, kept in step with match_results_tab by applying each match write's difference in the same transaction.
+    """
+    __tablename__ = 'team_standing_tab'
+
+    round_number = Column(TINYINT(unsigned=True), primary_key=True)
+    team_id = Column(TINYINT(unsigned=True), ForeignKey('team_tab.team_id', ondelete='CASCADE'), primary_key=True)
+    goals = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+
+    team = relationship('Team', back_populates='standings')
+
+    __table_args__ = {'mysql_engine': 'InnoDB'}
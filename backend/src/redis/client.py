@@ -0,0 +1,70 @@
+from redis import asyncio as aioredis
+from config import Settings
+from typing import Dict
+
+class RedisClient:
+    """
+    Process wide redis client backed by a single blocking connection pool.
+
+    DistributedLock and SessionStorage borrow connections from this pool instead of opening a new connection per call.
+    The pool is created in the FastAPI lifespan and closed there too.
+    """
+    instance = None
+    def __init__(self, settings: Settings):
+        settings = settings.get_instance()
+        self.settings = settings
+        self.pool: aioredis.BlockingConnectionPool = None
+        self.redis: aioredis.Redis = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = RedisClient(Settings.get_instance())
+        return cls.instance
+
+    async def connect(self) -> aioredis.Redis:
+        """
+        connect creates the connection pool and checks that redis is reachable.
+        """
+        redis = self.get_client()
+        await redis.ping()
+        return redis
+
+    def get_client(self) -> aioredis.Redis:
+        """
+        get_client returns the shared client, creating the pool lazily if used outside the lifespan (eg. scripts).
+        """
+        if self.redis is None:
+            self.pool = aioredis.BlockingConnectionPool.from_url(
+                self.settings.redis_url,
+                max_connections=self.settings.redis_max_connections,
+                timeout=self.settings.redis_pool_timeout,
+                socket_timeout=self.settings.redis_socket_timeout,
+                socket_connect_timeout=self.settings.redis_socket_connect_timeout,
+                health_check_interval=self.settings.redis_health_check_interval,
+            )
+            self.redis = aioredis.Redis(connection_pool=self.pool)
+        return self.redis
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+            await self.pool.disconnect()
+        self.redis = None
+        self.pool = None
+
+    def get_stats(self) -> Dict:
+        """
+        get_stats returns pool usage, to size REDIS_MAX_CONNECTIONS.
+        """
+        if self.pool is None:
+            return {"max_connections": self.settings.redis_max_connections, "created": 0, "in_use": 0, "available": 0}
+        # the asyncio pool does not count created connections, every one it made is either in use or available
+        in_use = len(self.pool._in_use_connections)
+        available = len(self.pool._available_connections)
+        return {
+            "max_connections": self.pool.max_connections,
+            "created": in_use + available,
+            "in_use": in_use,
+            "available": available,
+        }
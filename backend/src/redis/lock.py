@@ -1,8 +1,11 @@
-from redis import asyncio as aioredis
 import uuid
 import asyncio
 import time
-from config import Settings
+import logging
+from typing import Dict, Set, List, Iterable
+from src.redis.client import RedisClient
+from src.redis.pubsub import RedisSubscriber
+from src.utils.metrics import Metrics
 
 # Constant lock keys
 LOCK_PREFIX = "lock:"
@@ -11,34 +14,260 @@ TEAM_LOCK_KEY = LOCK_PREFIX + "team_lock"
 MATCH_LOCK_KEY = LOCK_PREFIX + "match_lock"
 USER_LOCK_KEY = LOCK_PREFIX + "user_lock"
 
+# released locks are announced on LOCK_RELEASED_PREFIX + lock_key
+LOCK_RELEASED_PREFIX = "lock_released:"
+
+# waiters queue in a sorted set ordered by ticket, each waiter keeps a heartbeat key alive while it waits
+# a waiter can only take the lock when it is at the head of the queue, so the lock is handed out first come first served
+ACQUIRE_SCRIPT = """
+local waiter_key = ARGV[4] .. ARGV[1]
+redis.call('set', waiter_key, 1, 'PX', ARGV[3])
+if not redis.call('zscore', KEYS[2], ARGV[1]) then
+    redis.call('zadd', KEYS[2], redis.call('incr', KEYS[3]), ARGV[1])
+end
+redis.call('pexpire', KEYS[2], ARGV[3])
+redis.call('pexpire', KEYS[3], ARGV[3])
+local head = redis.call('zrange', KEYS[2], 0, 0)[1]
+while head ~= ARGV[1] and redis.call('exists', ARGV[4] .. head) == 0 do
+    -- waiter gave up or died without leaving the queue
+    redis.call('zrem', KEYS[2], head)
+    head = redis.call('zrange', KEYS[2], 0, 0)[1]
+end
+if head == ARGV[1] and redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') then
+    redis.call('zrem', KEYS[2], ARGV[1])
+    redis.call('del', waiter_key)
+    return 1
+end
+return 0
+"""
+
+# compare and delete, so an expired holder cannot delete a lock that has since been given to someone else
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    redis.call('publish', ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# extends the lease only while it is still held by the caller
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+LEAVE_QUEUE_SCRIPT = """
+redis.call('zrem', KEYS[1], ARGV[1])
+redis.call('del', ARGV[3] .. ARGV[1])
+redis.call('publish', ARGV[2], ARGV[1])
+return 1
+"""
+
 
 class DistributedLock:
-    def __init__(self, lock_key: str, ttl: int = 5):
-        self.redis_url = Settings.get_instance().redis_url
+    # lock_key -> events of waiters in this process, set when the lock is released
+    waiters: Dict[str, Set[asyncio.Event]] = {}
+    # lock_key -> in process lock, waiters on the same worker queue here and only the head contends in redis
+    local_locks: Dict[str, asyncio.Lock] = {}
+
+    def __init__(self, lock_key: str, ttl: int = 5, renew: bool = False):
+        self.redis_client = RedisClient.get_instance()
         self.lock_key = lock_key
         self.ttl = ttl
-        self.lock_value = str(uuid.uuid4()) 
+        # renew keeps extending the lease while the holder is alive, for critical sections that may outlive ttl
+        self.renew = renew
+        self.renewer: asyncio.Task = None
+        self.acquired_at: float = None
+        self.local_lock = DistributedLock.local_locks.setdefault(lock_key, asyncio.Lock())
+        self.local_held = False
+        self.lock_value = str(uuid.uuid4())
         # unique value for the lock, so no deletion by other clients
         # eg. one client finished task and wants to give back though their lock_key had expired
+        self.queue_key = lock_key + ":queue"
+        self.queue_seq_key = lock_key + ":queue_seq"
+        self.waiter_prefix = lock_key + ":waiter:"
+        self.release_channel = LOCK_RELEASED_PREFIX + lock_key
+
+    async def get(self, timeout_seconds: float = 5, interval: float = 0.5) -> bool:
+        """
+        get queues for the lock and waits until it is handed over or timeout_seconds pass.
 
-    async def get(self, timeout_seconds: int = 1, interval: float = 0.5) -> bool:
+        Waiters are woken by the release notification, interval is only the fallback recheck for leases that expire without a release.
+        """
         start_time = time.time()
-        async with aioredis.from_url(self.redis_url) as redis:
-            # if lock is not set, set it and return True
-            # if lock is already set, return False, retry after some time
-            while time.time() - start_time < timeout_seconds:
-                result = await redis.set(self.lock_key, self.lock_value, ex=self.ttl, nx=True)
-                if result:
+        if not await self._get_local(timeout_seconds):
+            Metrics.get_instance().increment("lock_timeout")
+            return False
+        redis = self.redis_client.get_client()
+        acquire = redis.register_script(ACQUIRE_SCRIPT)
+        await self._subscribe_releases()
+        event = asyncio.Event()
+        waiters = DistributedLock.waiters.setdefault(self.lock_key, set())
+        waiters.add(event)
+        # heartbeat outlives a few rechecks, so a live waiter keeps its place in the queue
+        waiter_ttl_ms = int(interval * 4000) + 1000
+        is_acquired = False
+        is_contended = False
+        try:
+            while True:
+                event.clear()
+                result = await acquire(keys=[self.lock_key, self.queue_key, self.queue_seq_key], args=[self.lock_value, self.ttl * 1000, waiter_ttl_ms, self.waiter_prefix])
+                if result == 1:
+                    is_acquired = True
+                    self.acquired_at = time.time()
+                    Metrics.get_instance().increment("lock_acquired")
+                    Metrics.get_instance().observe("lock_wait_seconds", self.acquired_at - start_time)
+                    if self.renew:
+                        self.renewer = asyncio.create_task(self._renew_lease(asyncio.current_task()))
                     return True
-                await asyncio.sleep(interval)
+                if not is_contended:
+                    # held by another worker, only the head of this worker's local queue gets here
+                    is_contended = True
+                    Metrics.get_instance().increment("lock_remote_contended")
+                remaining = timeout_seconds - (time.time() - start_time)
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+            # leave the queue so the waiters behind are not held up
+            await redis.register_script(LEAVE_QUEUE_SCRIPT)(keys=[self.queue_key], args=[self.lock_value, self.release_channel, self.waiter_prefix])
+            Metrics.get_instance().increment("lock_timeout")
             return False
-                
+        finally:
+            waiters.discard(event)
+            if len(waiters) == 0:
+                DistributedLock.waiters.pop(self.lock_key, None)
+            if not is_acquired:
+                self._give_local()
+
+    async def give(self) -> bool:
+        if self.renewer is not None:
+            self.renewer.cancel()
+            self.renewer = None
+        redis = self.redis_client.get_client()
+        # give back lock if it belongs to the client
+        result = await redis.register_script(RELEASE_SCRIPT)(keys=[self.lock_key], args=[self.lock_value, self.release_channel])
+        if result == 1 and self.acquired_at is not None:
+            # how far into the original lease the critical section ran, > 1 means it only survived through renewal
+            held_seconds = time.time() - self.acquired_at
+            Metrics.get_instance().observe("lock_held_seconds", held_seconds)
+            Metrics.get_instance().observe("lock_lease_fraction", held_seconds / self.ttl)
+            self.acquired_at = None
+        self._give_local()
+        return result == 1
+
+    async def _get_local(self, timeout_seconds: float) -> bool:
+        """
+        _get_local queues behind holders of the same key on this worker.
+
+        The local lock is also given back when the holding task finishes, so a holder that never calls give() cannot wedge the worker after its lease expires.
+        """
+        if self.local_lock.locked():
+            Metrics.get_instance().increment("lock_local_contended")
+            try:
+                await asyncio.wait_for(self.local_lock.acquire(), max(timeout_seconds, 0))
+            except asyncio.TimeoutError:
+                return False
+        else:
+            await self.local_lock.acquire()
+        self.local_held = True
+        holder = asyncio.current_task()
+        if holder is not None:
+            holder.add_done_callback(lambda _: self._give_local())
+        return True
+
+    def _give_local(self):
+        if self.local_held:
+            self.local_held = False
+            self.local_lock.release()
+
+    async def _renew_lease(self, holder: asyncio.Task):
+        """
+        _renew_lease extends the lease every third of ttl until give() cancels it, the holder task ends or the lease is lost.
+        """
+        redis = self.redis_client.get_client()
+        renew = redis.register_script(RENEW_SCRIPT)
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if holder is None or holder.done():
+                # holder exited without giving back, let the lease run out
+                return
+            try:
+                if await renew(keys=[self.lock_key], args=[self.lock_value, self.ttl * 1000]) != 1:
+                    Metrics.get_instance().increment("lock_lost")
+                    logging.error(f"lost lock {self.lock_key} before it was given back")
+                    return
+                Metrics.get_instance().increment("lock_renewed")
+            except Exception as e:
+                # keep trying, the lease has ttl * 2/3 left
+                logging.error(f"failed to renew lock {self.lock_key}: {e}")
+
+    @staticmethod
+    async def _subscribe_releases():
+        try:
+            await RedisSubscriber.get_instance().psubscribe(LOCK_RELEASED_PREFIX + "*", DistributedLock._on_release)
+        except Exception as e:
+            # waiters still recheck every interval without notifications
+            logging.error(f"failed to subscribe to lock releases: {e}")
+
+    @staticmethod
+    def _on_release(message):
+        lock_key = message["channel"].decode()[len(LOCK_RELEASED_PREFIX):]
+        for event in DistributedLock.waiters.get(lock_key, ()):
+            event.set()
+
+
+# match data is locked per (round, group), coarser scopes take every leaf they cover
+MATCH_LOCK_ROUNDS = (1, 2, 3)
+MATCH_LOCK_GROUPS = (1, 2)
+
+def match_lock_key(round_number: int, group_number: int) -> str:
+    return f"{MATCH_LOCK_KEY}:round:{round_number}:group:{group_number}"
+
+
+class MatchLock:
+    """
+    Lock over match data scoped to the whole tournament, a round, or groups within a round.
+
+    A scope is taken as the set of (round, group) leaf locks it covers, acquired in sorted key order so two writers can never wait on each other in a cycle.
+    Writes in different rounds or groups take disjoint leaves and run in parallel.
+    Defaults to tournament scope until scope() narrows it, so it is safe as a drop in for the old global match lock.
+    """
+    def __init__(self, ttl: int = 5, renew: bool = False):
+        self.ttl = ttl
+        self.renew = renew
+        self.locks: List[DistributedLock] = []
+        self.held: List[DistributedLock] = []
+        self.scope()
+
+    def scope(self, round_number: int = None, group_numbers: Iterable[int] = None) -> "MatchLock":
+        """
+        scope narrows the lock to round_number (all rounds if None) and group_numbers (all groups if None or empty).
+        """
+        round_numbers = MATCH_LOCK_ROUNDS if round_number is None else (round_number,)
+        group_numbers = MATCH_LOCK_GROUPS if not group_numbers else tuple(set(group_numbers))
+        keys = sorted({match_lock_key(r, g) for r in round_numbers for g in group_numbers})
+        self.locks = [DistributedLock(key, ttl=self.ttl, renew=self.renew) for key in keys]
+        return self
+
+    async def get(self, timeout_seconds: float = 5, interval: float = 0.5) -> bool:
+        start_time = time.time()
+        for lock in self.locks:
+            remaining = timeout_seconds - (time.time() - start_time)
+            if not await lock.get(timeout_seconds=max(remaining, 0), interval=interval):
+                await self.give()
+                return False
+            self.held.append(lock)
+        return True
 
     async def give(self) -> bool:
-        async with aioredis.from_url(self.redis_url) as redis:
-            # give back lock if it belongs to the client
-            lock_value = await redis.get(self.lock_key)
-            if lock_value and lock_value.decode() == self.lock_value:
-                await redis.delete(self.lock_key)
-                return True
-            return False
\ No newline at end of file
+        # release in reverse order of acquisition
+        is_released = len(self.held) > 0
+        while self.held:
+            is_released = await self.held.pop().give() and is_released
+        return is_released
@@ -0,0 +1,96 @@
+from src.redis.client import RedisClient
+from typing import Callable, Dict
+import asyncio
+import logging
+
+class RedisSubscriber:
+    """
+    Process wide redis pub/sub listener.
+
+    Holds one pub/sub connection per worker and dispatches messages to the handler registered for each channel or channel pattern.
+    Handlers receive the redis-py message dict and must not block, they run on the listener task.
+    """
+    instance = None
+    def __init__(self):
+        self.redis_client = RedisClient.get_instance()
+        self.pubsub = None
+        self.listener: asyncio.Task = None
+        self.running = False
+        self.handlers: Dict[str, Callable] = {} # pattern -> handler
+        self.channel_handlers: Dict[str, Callable] = {} # channel -> handler
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = RedisSubscriber()
+        return cls.instance
+
+    async def psubscribe(self, pattern: str, handler: Callable):
+        """
+        psubscribe registers handler for channels matching pattern, starting the listener on first use.
+        """
+        if pattern in self.handlers:
+            return
+        self.handlers[pattern] = handler
+        try:
+            await self._get_pubsub().psubscribe(**{pattern: handler})
+        except Exception:
+            self.handlers.pop(pattern, None)
+            raise
+        self._start_listener()
+
+    async def subscribe(self, channel: str, handler: Callable):
+        """
+        subscribe registers handler for channel, starting the listener on first use.
+        """
+        if channel in self.channel_handlers:
+            return
+        self.channel_handlers[channel] = handler
+        try:
+            await self._get_pubsub().subscribe(**{channel: handler})
+        except Exception:
+            self.channel_handlers.pop(channel, None)
+            raise
+        self._start_listener()
+
+    async def unsubscribe(self, channel: str):
+        if self.channel_handlers.pop(channel, None) is not None and self.pubsub is not None:
+            await self.pubsub.unsubscribe(channel)
+
+    def _get_pubsub(self):
+        if self.pubsub is None:
+            self.pubsub = self.redis_client.get_client().pubsub(ignore_subscribe_messages=True)
+        return self.pubsub
+
+    def _start_listener(self):
+        if self.listener is None or self.listener.done():
+            self.running = True
+            self.listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        # a cancel landing as the read timeout fires can be swallowed by the timeout, so also stop on the flag
+        while self.running:
+            try:
+                # handled messages return None, the timeout lets health checks run on an idle connection
+                await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # pubsub reconnects and resubscribes on the next read
+                logging.error(f"redis subscriber error: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+        self.listener = None
+        self.pubsub = None
+        self.handlers = {}
+        self.channel_handlers = {}
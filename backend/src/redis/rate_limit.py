@@ -0,0 +1,89 @@
+import math
+import logging
+from typing import List, Tuple
+from fastapi import HTTPException
+from config import Settings
+from src.redis.client import RedisClient
+from src.utils.metrics import Metrics
+
+RATE_LIMIT_PREFIX = "rate_limit:"
+LOGIN_RATE_LIMIT_PREFIX = RATE_LIMIT_PREFIX + "login:"
+
+# token buckets refilled lazily from redis time, a token is taken from every bucket or from none
+# ARGV holds capacity and refill per ms for each key, returns {0, 0} when allowed else {retry after ms, 1 based index of the empty bucket}
+TAKE_TOKEN_SCRIPT = """
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local available = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local refill_per_ms = tonumber(ARGV[i * 2])
+    local bucket = redis.call('hmget', key, 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_per_ms)
+    if tokens < 1 then
+        return {math.ceil((1 - tokens) / refill_per_ms), i}
+    end
+    available[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local refill_per_ms = tonumber(ARGV[i * 2])
+    redis.call('hset', key, 'tokens', available[i] - 1, 'updated_at', now)
+    -- a bucket left alone refills completely, so it can be forgotten
+    redis.call('pexpire', key, math.ceil(capacity / refill_per_ms))
+end
+return {0, 0}
+"""
+
+
+class LoginRateLimiter:
+    """
+    Token bucket rate limiter for login attempts, keyed by username and by client ip.
+
+    The username bucket stops guessing at one account, the ip bucket stops one client spraying many accounts.
+    It is checked before the user lookup and bcrypt, so rejected attempts cost one redis call.
+    """
+    instance = None
+    def __init__(self, settings: Settings):
+        settings = settings.get_instance()
+        self.settings = settings
+        self.redis_client = RedisClient.get_instance()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = LoginRateLimiter(Settings.get_instance())
+        return cls.instance
+
+    async def check(self, username: str, client_ip: str = None) -> bool:
+        """
+        check takes a login token for username and client_ip, raising 429 with Retry-After if either bucket is empty.
+
+        Fails open if redis is unavailable, bcrypt admission control still bounds the work per worker.
+        """
+        if not self.settings.login_rate_limit_enabled:
+            return True
+        buckets: List[Tuple[str, str, int, float]] = [
+            ("username", LOGIN_RATE_LIMIT_PREFIX + "user:" + username.lower(), self.settings.login_rate_limit_user_burst, self.settings.login_rate_limit_user_per_minute),
+        ]
+        if client_ip is not None:
+            buckets.append(("ip", LOGIN_RATE_LIMIT_PREFIX + "ip:" + client_ip, self.settings.login_rate_limit_ip_burst, self.settings.login_rate_limit_ip_per_minute))
+        args = []
+        for _, _, capacity, per_minute in buckets:
+            args += [capacity, per_minute / 60000]
+        try:
+            redis = self.redis_client.get_client()
+            retry_after_ms, bucket_index = await redis.register_script(TAKE_TOKEN_SCRIPT)(keys=[key for _, key, _, _ in buckets], args=args)
+        except Exception as e:
+            Metrics.get_instance().increment("login_rate_limit_errors")
+            logging.error(f"login rate limiter unavailable: {e}")
+            return True
+        if retry_after_ms > 0:
+            bucket_name = buckets[bucket_index - 1][0]
+            Metrics.get_instance().increment(f"login_rate_limited_{bucket_name}")
+            logging.warning(f"login rate limited by {bucket_name} for {username} from {client_ip}")
+            raise HTTPException(status_code=429, detail="Too many login attempts", headers={"Retry-After": str(math.ceil(retry_after_ms / 1000))})
+        Metrics.get_instance().increment("login_rate_limit_allowed")
+        return True
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List
+from config import Settings
+from src.redis.client import RedisClient
+from src.utils.metrics import Metrics
+
+READ_CACHE_PREFIX = "read_cache:"
+# data versions, bumped after every committed write. team writes bump the tournament version since team names and groups show up in every round
+READ_CACHE_TOURNAMENT_VERSION_KEY = "read_cache_version:tournament"
+READ_CACHE_ROUND_VERSION_PREFIX = "read_cache_version:round:"
+# held by the one worker building a missing entry, the others wait for the entry to show up instead of building it too
+READ_CACHE_FLIGHT_PREFIX = "read_cache_flight:"
+# seconds between checks for the entry while another worker builds it
+READ_CACHE_FLIGHT_POLL_INTERVAL = 0.02
+
+# compare and delete, so a builder that overran the lock cannot release one taken since
+FLIGHT_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def round_version_key(round_number: int) -> str:
+    return f"{READ_CACHE_ROUND_VERSION_PREFIX}{round_number}"
+
+class ReadCache:
+    """
+    Read-through cache of rendered rankings and results, shared by every worker in redis with a small in process layer in front.
+
+    Entries are keyed by the view and the data versions it was read at eg. read_cache:match_rankings:1:2@3.7 for
+    round 1 group 2 at tournament version 3 and round 1 version 7. Writes bump the versions after they commit, so a lookup after
+    a write only ever finds entries built from the new data and stale entries are left to expire, nothing is deleted.
+    Looking up costs one redis round trip for the versions, and a second for the entry when it is not held in process.
+
+    Misses are single flight: concurrent lookups of the same key on a worker share one build, and across workers the first to take
+    a short redis lock builds while the rest wait for its entry, so a burst of requests after a write costs one render per key.
+    """
+    instance = None
+    def __init__(self, settings: Settings):
+        settings = settings.get_instance()
+        self.enabled = settings.read_cache_enabled
+        self.ttl = settings.read_cache_ttl
+        self.redis_client = RedisClient.get_instance()
+        # key -> rendered payload, least recently used first. keys carry their versions so entries never go stale, only unused
+        self.local: OrderedDict[str, bytes] = OrderedDict()
+        self.local_size = settings.read_cache_local_size
+        # key -> result of the build in progress on this worker
+        self.flights: Dict[str, asyncio.Future] = {}
+        self.flight_timeout = settings.read_cache_flight_timeout
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = ReadCache(Settings.get_instance())
+        return cls.instance
+
+    async def get(self, view: Hashable, round_number: int, build: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        get returns view's rendered payload, built with build and cached if there is none for the current data version.
+
+        build must read in a transaction it starts itself, not one already open, or it can see data older than the versions.
+
+        Redis errors fall back to building from the database.
+        """
+        if not self.enabled:
+            return await build()
+        metrics = Metrics.get_instance()
+        parts = view if isinstance(view, tuple) else (view,)
+        try:
+            redis = self.redis_client.get_client()
+            tournament_version, round_version = await redis.mget(READ_CACHE_TOURNAMENT_VERSION_KEY, round_version_key(round_number))
+            key = f"{READ_CACHE_PREFIX}{':'.join(str(part) for part in parts)}@{int(tournament_version or 0)}.{int(round_version or 0)}"
+            payload = self.local.get(key)
+            if payload is not None:
+                self.local.move_to_end(key)
+                metrics.increment("read_cache_local_hit")
+                self._record_hit_rate()
+                return payload
+            payload = await redis.get(key)
+            if payload is not None:
+                metrics.increment("read_cache_hit")
+                self._record_hit_rate()
+                self._local_put(key, payload)
+                return payload
+        except Exception as e:
+            metrics.increment("read_cache_errors")
+            logging.error(f"read cache lookup failed for {view}: {e}")
+            return await build()
+        metrics.increment("read_cache_miss")
+        self._record_hit_rate()
+        flight = self.flights.get(key)
+        if flight is not None:
+            metrics.increment("read_cache_coalesced")
+            try:
+                # shielded, a waiter going away must not cancel the build for the others
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # the request building it went away, take over
+                return await self.get(view, round_number, build)
+        flight = asyncio.get_running_loop().create_future()
+        self.flights[key] = flight
+        try:
+            payload = await self._fill(view, key, build)
+            flight.set_result(payload)
+            return payload
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            # waiters get the same error rather than each retrying against the database
+            flight.set_exception(e)
+            flight.exception()
+            raise
+        finally:
+            self.flights.pop(key, None)
+
+    async def _fill(self, view: Hashable, key: str, build: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        _fill builds and stores key's entry, or waits for the worker holding its flight lock to store it.
+
+        Waits for at most read_cache_flight_timeout, then builds anyway.
+        """
+        metrics = Metrics.get_instance()
+        redis = self.redis_client.get_client()
+        flight_key = READ_CACHE_FLIGHT_PREFIX + key
+        token = str(uuid.uuid4())
+        try:
+            is_builder = await redis.set(flight_key, token, nx=True, px=int(self.flight_timeout * 1000))
+            deadline = time.monotonic() + self.flight_timeout
+            while not is_builder and time.monotonic() < deadline:
+                await asyncio.sleep(READ_CACHE_FLIGHT_POLL_INTERVAL)
+                payload = await redis.get(key)
+                if payload is not None:
+                    metrics.increment("read_cache_coalesced_remote")
+                    self._local_put(key, payload)
+                    return payload
+                # taken over if the builder failed and released the lock without storing an entry
+                is_builder = await redis.set(flight_key, token, nx=True, px=int(self.flight_timeout * 1000))
+            if not is_builder:
+                metrics.increment("read_cache_flight_timeouts")
+        except Exception as e:
+            metrics.increment("read_cache_errors")
+            logging.error(f"read cache flight failed for {view}: {e}")
+        try:
+            start_time = time.perf_counter()
+            payload = await build()
+            metrics.observe("read_cache_rebuild_seconds", time.perf_counter() - start_time)
+            # build reads in a transaction started after the versions were read, so the payload is at least as new as the key says
+            try:
+                await redis.set(key, payload, ex=self.ttl)
+            except Exception as e:
+                metrics.increment("read_cache_errors")
+                logging.error(f"read cache store failed for {view}: {e}")
+            self._local_put(key, payload)
+            return payload
+        finally:
+            # released on failure too, so the workers waiting on it build rather than time out
+            try:
+                await redis.eval(FLIGHT_RELEASE_SCRIPT, 1, flight_key, token)
+            except Exception as e:
+                logging.error(f"read cache flight release failed for {view}: {e}")
+
+    async def bump(self, round_numbers: Iterable[int] = None):
+        """
+        bump moves the data version of round_numbers on, or of the whole tournament if none are given. Called after a write commits.
+
+        A failed bump leaves entries at the old version to be served until read_cache_ttl runs out.
+        """
+        if not self.enabled:
+            return
+        keys: List[str] = [READ_CACHE_TOURNAMENT_VERSION_KEY] if round_numbers is None else [round_version_key(round_number) for round_number in set(round_numbers)]
+        try:
+            async with self.redis_client.get_client().pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.incr(key)
+                await pipe.execute()
+            Metrics.get_instance().increment("read_cache_version_bumps", len(keys))
+        except Exception as e:
+            Metrics.get_instance().increment("read_cache_errors")
+            logging.error(f"read cache version bump failed for {keys}: {e}")
+
+    def _local_put(self, key: str, payload: bytes):
+        if self.local_size <= 0:
+            return
+        self.local[key] = payload
+        self.local.move_to_end(key)
+        while len(self.local) > self.local_size:
+            self.local.popitem(last=False)
+
+    def _record_hit_rate(self):
+        counters = Metrics.get_instance().counters
+        hits = counters.get("read_cache_local_hit", 0) + counters.get("read_cache_hit", 0)
+        lookups = hits + counters.get("read_cache_miss", 0)
+        Metrics.get_instance().set_gauge("read_cache_hit_rate", hits / lookups if lookups > 0 else 0.0)
@@ -1,46 +1,305 @@
-from redis import asyncio as aioredis
 from src.schemas.user import UserSessionStoreValue
 import uuid
-import asyncio
 import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Tuple, Set, Dict, List
 from config import Settings
+from src.redis.client import RedisClient
+from src.redis.pubsub import RedisSubscriber
 from src.schemas.user import UserRole
+from src.utils.metrics import Metrics
+from src.utils.crypto import sign_token, verify_token
 
 SESSION_PREFIX = "session:"
 ADMIN_SESSION_PREFIX = "admin_session:"
 
+# deleted session ids are announced here so every worker drops them from its cache, "*" drops everything
+SESSION_INVALIDATED_CHANNEL = "session_invalidated"
+INVALIDATE_ALL = "*"
+
+# signed sessions (SESSION_MODE=signed) are verified locally, revocation state lives in redis and is mirrored per worker
+SIGNED_SESSION_PREFIX = "signed:"
+# session ids revoked before expiry, scored by expiry so expired entries can be pruned
+SESSION_DENYLIST_KEY = "session_denylist"
+# non admin signed sessions issued before the current generation are revoked
+SESSION_GENERATION_KEY = "session_generation"
+# user_id / team_id -> unix time in ms, signed sessions of the user or team issued at or before it are revoked
+SESSION_REVOKED_USERS_KEY = "session_revoked_users"
+SESSION_REVOKED_TEAMS_KEY = "session_revoked_teams"
+
+# redis sessions are indexed by role, user and team so bulk revocation never scans the keyspace
+SESSION_INDEX_PREFIX = "session_index:"
+# session keys are unlinked this many per command
+REVOKE_CHUNK_SIZE = 500
+
+def role_index_key(user_role: UserRole) -> str:
+    return f"{SESSION_INDEX_PREFIX}role:{user_role.value}"
+
+def user_index_key(user_id: int) -> str:
+    return f"{SESSION_INDEX_PREFIX}user:{user_id}"
+
+def team_index_key(team_id: int) -> str:
+    return f"{SESSION_INDEX_PREFIX}team:{team_id}"
+
 class SessionStorage:
     instance = None
     def __init__(self):
-        self.redis_url = Settings.get_instance().redis_url
+        settings = Settings.get_instance()
+        self.redis_client = RedisClient.get_instance()
+
+        # session_id -> (expires_at, session), least recently used first
+        # entries expire after cache_ttl even if an invalidation is missed
+        self.cache: OrderedDict[str, Tuple[float, UserSessionStoreValue]] = OrderedDict()
+        self.cache_size = settings.session_cache_size
+        self.cache_ttl = settings.session_cache_ttl
+        # bumped on every invalidation, a lookup that raced one is not cached
+        self.cache_generation = 0
+
+        self.session_mode = settings.session_mode
+        self.signing_key = settings.session_signing_key
+        if self.session_mode == "signed" and not self.signing_key:
+            raise ValueError("SESSION_SIGNING_KEY must be set when SESSION_MODE is signed")
+        # local mirror of the revocation state, reloaded after an invalidation or once older than cache_ttl
+        self.denied_session_ids: Set[str] = set()
+        self.session_generation = 0
+        self.revoked_users: Dict[int, int] = {} # user_id -> revoked at
+        self.revoked_teams: Dict[int, int] = {} # team_id -> revoked at
+        self.revocations_expire_at = 0.0
+        self.revocations_loaded = False
+        # cache_generation the mirror was last loaded at, behind it after an invalidation until reloaded
+        self.revocations_generation = 0
+        self.revocations_refresh: asyncio.Task = None
+        self.revocations_refresh_generation = 0
 
     @staticmethod
     def get_instance():
         if SessionStorage.instance is None:
             SessionStorage.instance = SessionStorage()
         return SessionStorage.instance
-    
+
     async def create_session(self, user_session: UserSessionStoreValue, ttl: int = 60 * 60 * 24) -> str:
+        if self.session_mode == "signed":
+            return await self._create_signed_session(user_session, ttl)
         session_id = SESSION_PREFIX + str(uuid.uuid4()) if user_session.user_role != UserRole.admin else ADMIN_SESSION_PREFIX + str(uuid.uuid4())
-        async with aioredis.from_url(self.redis_url) as redis:
-            await redis.set( session_id, user_session.model_dump_json(), ex=ttl)
+        index_keys = [role_index_key(user_session.user_role), user_index_key(user_session.user_id)]
+        if user_session.team_id is not None:
+            index_keys.append(team_index_key(user_session.team_id))
+        async with self.redis_client.get_client().pipeline(transaction=True) as pipe:
+            pipe.set( session_id, user_session.model_dump_json(), ex=ttl)
+            for index_key in index_keys:
+                # members outlive their sessions until the index expires, unlinking a missing key is harmless
+                pipe.sadd(index_key, session_id)
+                pipe.expire(index_key, ttl)
+            await pipe.execute()
         return session_id
-    
+
     async def get_session(self, session_id: str) -> UserSessionStoreValue:
-        async with aioredis.from_url(self.redis_url) as redis:
-            session_data = await redis.get(session_id)
-            if session_data:
-                return UserSessionStoreValue.model_validate_json(session_data.decode())
-            return None
-    
+        if session_id.startswith(SIGNED_SESSION_PREFIX):
+            return await self._get_signed_session(session_id)
+        cached = self.cache.get(session_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self.cache.move_to_end(session_id)
+            Metrics.get_instance().increment("session_cache_hit")
+            return cached[1]
+        Metrics.get_instance().increment("session_cache_miss")
+        await self._subscribe_invalidations()
+        generation = self.cache_generation
+        redis = self.redis_client.get_client()
+        session_data = await redis.get(session_id)
+        if session_data:
+            user_session = UserSessionStoreValue.model_validate_json(session_data.decode())
+            if generation == self.cache_generation:
+                self._cache_put(session_id, user_session)
+            return user_session
+        self.cache.pop(session_id, None)
+        return None
+
     async def delete_session(self, session_id: str) -> bool:
-        async with aioredis.from_url(self.redis_url) as redis:
-            return await redis.delete(session_id)
-        
+        if session_id.startswith(SIGNED_SESSION_PREFIX):
+            return await self._delete_signed_session(session_id)
+        redis = self.redis_client.get_client()
+        is_deleted = await redis.delete(session_id)
+        await self._invalidate(session_id)
+        return is_deleted
+
     async def delete_all_sessions_except_admin(self) -> bool:
-        async with aioredis.from_url(self.redis_url) as redis:
-            keys = await redis.keys(SESSION_PREFIX + "*")
-            if keys:
-                await redis.delete(*keys)
-            return True
-    
\ No newline at end of file
+        redis = self.redis_client.get_client()
+        for user_role in UserRole:
+            if user_role != UserRole.admin:
+                await self._revoke_index(role_index_key(user_role))
+        # signed sessions issued before this generation are rejected
+        self.session_generation = await redis.incr(SESSION_GENERATION_KEY)
+        await self._invalidate(INVALIDATE_ALL)
+        return True
+
+    async def delete_all_sessions_for_user(self, user_id: int) -> int:
+        """
+        delete_all_sessions_for_user signs the user out everywhere.
+
+        Returns:
+        revoked_count: int: number of redis sessions removed, signed sessions are revoked without being counted
+        """
+        revoked_count = await self._revoke_index(user_index_key(user_id))
+        revoked_at = int(time.time() * 1000)
+        self.revoked_users[user_id] = revoked_at
+        await self.redis_client.get_client().hset(SESSION_REVOKED_USERS_KEY, str(user_id), revoked_at)
+        await self._invalidate(INVALIDATE_ALL)
+        return revoked_count
+
+    async def delete_all_sessions_for_team(self, team_id: int) -> int:
+        """
+        delete_all_sessions_for_team signs out every player and manager of the team.
+
+        Returns:
+        revoked_count: int: number of redis sessions removed, signed sessions are revoked without being counted
+        """
+        revoked_count = await self._revoke_index(team_index_key(team_id))
+        revoked_at = int(time.time() * 1000)
+        self.revoked_teams[team_id] = revoked_at
+        await self.redis_client.get_client().hset(SESSION_REVOKED_TEAMS_KEY, str(team_id), revoked_at)
+        await self._invalidate(INVALIDATE_ALL)
+        return revoked_count
+
+    async def _revoke_index(self, index_key: str) -> int:
+        """
+        _revoke_index unlinks every session in the index in chunks, then the index itself.
+
+        SSCAN and UNLINK keep each command small, so other clients are not stalled by a large revocation.
+        """
+        redis = self.redis_client.get_client()
+        chunk: List[bytes] = []
+        async with redis.pipeline(transaction=False) as pipe:
+            async for session_id in redis.sscan_iter(index_key, count=REVOKE_CHUNK_SIZE):
+                chunk.append(session_id)
+                if len(chunk) == REVOKE_CHUNK_SIZE:
+                    pipe.unlink(*chunk)
+                    chunk = []
+            if chunk:
+                pipe.unlink(*chunk)
+            pipe.unlink(index_key)
+            # the last result is the index itself
+            revoked_count = sum((await pipe.execute())[:-1])
+        Metrics.get_instance().increment("sessions_revoked", revoked_count)
+        return revoked_count
+
+    async def _create_signed_session(self, user_session: UserSessionStoreValue, ttl: int) -> str:
+        try:
+            # read the generation fresh, a token issued with a stale one would be rejected by up to date workers
+            self.session_generation = int(await self.redis_client.get_client().get(SESSION_GENERATION_KEY) or 0)
+        except Exception as e:
+            logging.error(f"failed to read session generation: {e}")
+        payload = {
+            "sid": str(uuid.uuid4()),
+            "uid": user_session.user_id,
+            "role": user_session.user_role.value,
+            "tid": user_session.team_id,
+            "iat": int(time.time() * 1000), # ms, compared against revoked at
+            "exp": int(time.time()) + ttl,
+            "gen": self.session_generation,
+        }
+        return SIGNED_SESSION_PREFIX + sign_token(payload, self.signing_key)
+
+    def _verify_signed_session(self, session_id: str) -> dict:
+        if not self.signing_key:
+            return None
+        payload = verify_token(session_id[len(SIGNED_SESSION_PREFIX):], self.signing_key)
+        if payload is None or payload["exp"] < time.time():
+            return None
+        return payload
+
+    async def _get_signed_session(self, session_id: str) -> UserSessionStoreValue:
+        payload = self._verify_signed_session(session_id)
+        if payload is None:
+            return None
+        if not self.revocations_loaded or self.revocations_generation != self.cache_generation:
+            # an invalidation since the mirror was loaded may have revoked this very session, wait for the reload
+            await asyncio.shield(self._start_revocations_refresh())
+        elif time.monotonic() >= self.revocations_expire_at and (self.revocations_refresh is None or self.revocations_refresh.done()):
+            # serve the current mirror and refresh it off the request path
+            self._start_revocations_refresh()
+        if payload["sid"] in self.denied_session_ids:
+            return None
+        if payload["role"] != UserRole.admin.value and payload["gen"] < self.session_generation:
+            return None
+        if payload["iat"] <= self.revoked_users.get(payload["uid"], -1) or payload["iat"] <= self.revoked_teams.get(payload["tid"], -1):
+            return None
+        return UserSessionStoreValue(user_id=payload["uid"], user_role=payload["role"], team_id=payload["tid"])
+
+    async def _delete_signed_session(self, session_id: str) -> int:
+        payload = self._verify_signed_session(session_id)
+        if payload is None:
+            return 0
+        self.denied_session_ids.add(payload["sid"])
+        await self.redis_client.get_client().zadd(SESSION_DENYLIST_KEY, {payload["sid"]: payload["exp"]})
+        await self._invalidate(session_id)
+        return 1
+
+    def _start_revocations_refresh(self) -> asyncio.Task:
+        """
+        _start_revocations_refresh starts reloading the revocation mirror, or returns the reload in progress if it started after the last invalidation.
+        """
+        if self.revocations_refresh is None or self.revocations_refresh.done() or self.revocations_refresh_generation != self.cache_generation:
+            self.revocations_refresh_generation = self.cache_generation
+            self.revocations_refresh = asyncio.create_task(self._refresh_revocations())
+        return self.revocations_refresh
+
+    async def _refresh_revocations(self):
+        """
+        _refresh_revocations reloads the deny list and generation into the local mirror.
+
+        If redis is unreachable the last known state keeps being served, so signed sessions do not depend on redis being up.
+        Lookups after an invalidation retry the reload until it succeeds.
+        """
+        await self._subscribe_invalidations()
+        generation = self.cache_generation
+        self.revocations_expire_at = time.monotonic() + self.cache_ttl
+        try:
+            async with self.redis_client.get_client().pipeline(transaction=False) as pipe:
+                pipe.zremrangebyscore(SESSION_DENYLIST_KEY, "-inf", int(time.time()))
+                pipe.zrange(SESSION_DENYLIST_KEY, 0, -1)
+                pipe.get(SESSION_GENERATION_KEY)
+                pipe.hgetall(SESSION_REVOKED_USERS_KEY)
+                pipe.hgetall(SESSION_REVOKED_TEAMS_KEY)
+                _, denied_session_ids, session_generation, revoked_users, revoked_teams = await pipe.execute()
+            self.denied_session_ids = {session_id.decode() for session_id in denied_session_ids}
+            self.session_generation = int(session_generation or 0)
+            self.revoked_users = {int(user_id): int(revoked_at) for user_id, revoked_at in revoked_users.items()}
+            self.revoked_teams = {int(team_id): int(revoked_at) for team_id, revoked_at in revoked_teams.items()}
+            self.revocations_loaded = True
+            self.revocations_generation = generation
+        except Exception as e:
+            logging.error(f"failed to refresh session revocations: {e}")
+
+    def _cache_put(self, session_id: str, user_session: UserSessionStoreValue):
+        self.cache[session_id] = (time.monotonic() + self.cache_ttl, user_session)
+        self.cache.move_to_end(session_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _drop_cached(self, session_id: str):
+        # also marks the signed session revocation mirror out of date, lookups wait for it to be reloaded
+        self.cache_generation += 1
+        if session_id == INVALIDATE_ALL:
+            self.cache.clear()
+        else:
+            self.cache.pop(session_id, None)
+
+    async def _invalidate(self, session_id: str):
+        # drop locally right away, other workers drop it when the message arrives
+        self._drop_cached(session_id)
+        await self.redis_client.get_client().publish(SESSION_INVALIDATED_CHANNEL, session_id)
+
+    async def _subscribe_invalidations(self):
+        try:
+            await RedisSubscriber.get_instance().psubscribe(SESSION_INVALIDATED_CHANNEL, self._on_invalidated)
+        except Exception as e:
+            # cached sessions still expire after cache_ttl
+            logging.error(f"failed to subscribe to session invalidations: {e}")
+
+    def _on_invalidated(self, message):
+        self._drop_cached(message["data"].decode())
+        if self.revocations_loaded:
+            # reload right away, so the next lookup of a signed session rarely has to wait for it
+            self._start_revocations_refresh()
@@ -1,13 +1,18 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete, update
+from sqlalchemy import delete, update, func, case
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Select
+from sqlalchemy.dialects.mysql import insert
 from src.models.game_match import GameMatch
 from src.models.match_results import MatchResults
 from src.models.team import Team
-from src.schemas.match_results import MatchResultDetailed, MatchResultSparse
+from src.models.team_standing import TeamStanding
+from src.schemas.match_results import MatchResultDetailed, MatchResultSparse, MatchResultScore
+from src.schemas.rank import TeamStandingDetailed
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from fastapi import HTTPException
-from typing import List
+from typing import List, Tuple
 
 
 class MatchRepository:
@@ -97,6 +102,183 @@ class MatchRepository:
         except HTTPException as e:
             raise HTTPException(status_code=e.status_code, detail=e.detail)
         
+    async def get_match_scores(self, match_ids: List[int] = None, team_id: int = None) -> List[MatchResultScore]:
+        """
+        Gets both results of the given matches, or of every match team_id played, or of all matches if neither is given.
+
+        Args:
+        match_ids: List[int]
+        team_id: int
+
+        Returns:
+        scores: List[MatchResultScore]: two per match, with the match's round number.
+        """
+        try:
+            query = select(GameMatch.round_number, MatchResults.match_id, MatchResults.team_id, MatchResults.goals_scored).join(GameMatch, GameMatch.match_id == MatchResults.match_id)
+            if match_ids is not None:
+                query = query.where(MatchResults.match_id.in_(match_ids))
+            if team_id is not None:
+                query = query.where(MatchResults.match_id.in_(select(MatchResults.match_id).where(MatchResults.team_id == team_id)))
+            result = await self.db.execute(query)
+            return [MatchResultScore(
+                round_number=row[0],
+                match_id=row[1],
+                team_id=row[2],
+                goals_scored=row[3]
+            ) for row in result.fetchall()]
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    async def add_to_standings(self, deltas: List[TeamStanding]) -> bool:
+        """
+        Adds deltas onto the stored standings, creating the rows of teams without one for the round. Needs to commit transaction.
+
+        Args:
+        deltas: List[TeamStanding]: amounts to add, negative for matches taken away.
+
+        Returns:
+        is_successful: bool
+        """
+        if len(deltas) == 0:
+            return True
+        try:
+            query = insert(TeamStanding).values([{"round_number": delta.round_number, "team_id": delta.team_id, "goals": delta.goals, "wins": delta.wins, "draws": delta.draws, "losses": delta.losses} for delta in deltas])
+            query = query.on_duplicate_key_update(
+                goals=TeamStanding.goals + query.inserted.goals,
+                wins=TeamStanding.wins + query.inserted.wins,
+                draws=TeamStanding.draws + query.inserted.draws,
+                losses=TeamStanding.losses + query.inserted.losses,
+            )
+            await self.db.execute(query)
+            return True
+        except SQLAlchemyError as e:
+            await self.rollback_transaction()
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    async def get_standings(self, round_number: int, group_number_filter: int = None) -> List[TeamStandingDetailed]:
+        """
+        Gets the stored standing of every team for a round, zeroes for teams that have not played, ordered by group.
+
+        Args:
+        round_number: int
+        group_number_filter: int: only the teams of this group if given.
+
+        Returns:
+        standings: List[TeamStandingDetailed]: one per team.
+        """
+        return [TeamStandingDetailed(
+            group_number=row[0],
+            team_id=row[1],
+            team_name=row[2],
+            registration_day_of_year=row[3],
+            goals=row[4],
+            wins=row[5],
+            draws=row[6],
+            losses=row[7]
+        ) for row in zip(*await self.get_standing_columns(round_number, group_number_filter))]
+
+    async def get_standing_columns(self, round_number: int, group_number_filter: int = None) -> List[tuple]:
+        """
+        Gets the same standings as get_standings as columns, for ranking without building an object per team.
+
+        Args:
+        round_number: int
+        group_number_filter: int: only the teams of this group if given.
+
+        Returns:
+        columns: List[tuple]: group_numbers, team_ids, team_names, registration_days_of_year, goals, wins, draws, losses, one entry per team in each. all empty if there are no teams.
+        """
+        try:
+            query = select(Team.group_number, Team.team_id, Team.team_name, Team.registration_day_of_year, func.coalesce(TeamStanding.goals, 0), func.coalesce(TeamStanding.wins, 0), func.coalesce(TeamStanding.draws, 0), func.coalesce(TeamStanding.losses, 0)).join(TeamStanding, (TeamStanding.team_id == Team.team_id) & (TeamStanding.round_number == round_number), isouter=True).order_by(Team.group_number)
+            if group_number_filter != None:
+                query = query.where(Team.group_number == group_number_filter)
+            result = await self.db.execute(query)
+            return list(zip(*result.fetchall())) or [()] * 8
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    def _standing_tally(self, round_number: int = None) -> Select:
+        """
+        _standing_tally aggregates match results into (round_number, team_id, goals, wins, draws, losses) per round and team.
+
+        Each result is joined to its opponent's through the match_results_tab primary key, so the database reads 2 rows per match and returns 1 per team.
+        """
+        mine = aliased(MatchResults)
+        theirs = aliased(MatchResults)
+        query = select(
+            GameMatch.round_number,
+            mine.team_id,
+            func.sum(mine.goals_scored).label("goals"),
+            func.sum(case((mine.goals_scored > theirs.goals_scored, 1), else_=0)).label("wins"),
+            func.sum(case((mine.goals_scored == theirs.goals_scored, 1), else_=0)).label("draws"),
+            func.sum(case((mine.goals_scored < theirs.goals_scored, 1), else_=0)).label("losses"),
+        ).join(theirs, (theirs.match_id == mine.match_id) & (theirs.team_id != mine.team_id)).join(GameMatch, GameMatch.match_id == mine.match_id).group_by(GameMatch.round_number, mine.team_id)
+        if round_number is not None:
+            query = query.where(GameMatch.round_number == round_number)
+        return query
+
+    async def get_standings_aggregated(self, round_number: int, group_number_filter: int = None) -> List[TeamStandingDetailed]:
+        """
+        Computes every team's standing for a round from the match results in the database, zeroes for teams that have not played, ordered by group.
+
+        Same rows as get_standings, but read from the match history rather than the stored standings.
+
+        Args:
+        round_number: int
+        group_number_filter: int: only the teams of this group if given.
+
+        Returns:
+        standings: List[TeamStandingDetailed]: one per team.
+        """
+        try:
+            tally = self._standing_tally(round_number).subquery()
+            query = select(Team.group_number, Team.team_id, Team.team_name, Team.registration_day_of_year, func.coalesce(tally.c.goals, 0), func.coalesce(tally.c.wins, 0), func.coalesce(tally.c.draws, 0), func.coalesce(tally.c.losses, 0)).join(tally, tally.c.team_id == Team.team_id, isouter=True).order_by(Team.group_number)
+            if group_number_filter != None:
+                query = query.where(Team.group_number == group_number_filter)
+            result = await self.db.execute(query)
+            return [TeamStandingDetailed(
+                group_number=row[0],
+                team_id=row[1],
+                team_name=row[2],
+                registration_day_of_year=row[3],
+                goals=row[4],
+                wins=row[5],
+                draws=row[6],
+                losses=row[7]
+            ) for row in result.fetchall()]
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    async def is_standings_missing(self) -> bool:
+        """
+        Checks whether there are match results but no stored standings, as when team_standing_tab is added to a database that already has matches.
+
+        Returns:
+        is_missing: bool
+        """
+        try:
+            query = select(select(MatchResults.match_id).exists(), select(TeamStanding.team_id).exists())
+            has_results, has_standings = (await self.db.execute(query)).one()
+            return bool(has_results) and not bool(has_standings)
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    async def rebuild_standings(self) -> int:
+        """
+        Replaces the stored standings with ones aggregated from the match results, in one INSERT ... SELECT. Needs to commit transaction.
+
+        Returns:
+        standing_count: int: number of standings written
+        """
+        try:
+            await self.db.execute(delete(TeamStanding))
+            tally = self._standing_tally()
+            result = await self.db.execute(insert(TeamStanding).from_select(["round_number", "team_id", "goals", "wins", "draws", "losses"], tally))
+            return result.rowcount
+        except SQLAlchemyError as e:
+            await self.rollback_transaction()
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
     async def get_matchups_by_round_and_team_ids(self, round_number: int, team_ids: List[int]) -> List[MatchResultSparse]:
         try:
             query = select(Team.team_name, MatchResults.match_id,  MatchResults.team_id).join(GameMatch, GameMatch.match_id == MatchResults.match_id).where(GameMatch.round_number == round_number).where(MatchResults.team_id.in_(team_ids)).join(Team, Team.team_id == MatchResults.team_id)
@@ -111,6 +293,27 @@ class MatchRepository:
         except HTTPException as e:
             raise HTTPException(status_code=e.status_code, detail=e.detail)
 
+    async def get_round_and_group_numbers_by_match_id(self, match_id: int) -> Tuple[int, List[int]]:
+        """
+        Gets the round a match was played in, as stored, and the group numbers of the teams that played it.
+
+        Args:
+        match_id: int
+
+        Returns:
+        round_number: int: None if the match does not exist.
+        group_numbers: List[int]: distinct group numbers, empty if the match does not exist.
+        """
+        try:
+            query = select(GameMatch.round_number, Team.group_number).join(MatchResults, MatchResults.match_id == GameMatch.match_id).join(Team, Team.team_id == MatchResults.team_id).where(GameMatch.match_id == match_id).distinct()
+            result = await self.db.execute(query)
+            rows = result.fetchall()
+            if len(rows) == 0:
+                return None, []
+            return rows[0][0], [row[1] for row in rows]
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
     async def update_match_results_for_match_id(self, match_id: int, team_id: int, team_goals:int) -> bool:
         try:
             query = update(MatchResults).where(MatchResults.match_id == match_id).where(MatchResults.team_id == team_id).values(goals_scored=team_goals)
@@ -163,6 +366,8 @@ class MatchRepository:
             await self.db.execute(query)
             query = delete(MatchResults)
             await self.db.execute(query)
+            query = delete(TeamStanding)
+            await self.db.execute(query)
             return True
         except SQLAlchemyError as e:
             await self.rollback_transaction()
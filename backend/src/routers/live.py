@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi import WebSocket
+from src.controllers.broadcaster import Broadcaster
+from src.controllers.connection_controller import ConnectionController
+# renderers register with the broadcaster on import
+import src.controllers.match_core
+import src.controllers.team
+live_router = APIRouter()
+
+@live_router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, protocol: str = "snapshot", encoding: str = "text"):
+    """
+    One socket for any number of topics, the client sends {"type": "subscribe", "topic": "match_rankings:1:2"} and {"type": "unsubscribe", ...}.
+    Topics are teams, match_results:<round> and match_rankings:<round>:<group>. Each subscription starts with a snapshot frame of the topic,
+    followed by a snapshot frame after every write, or with ?protocol=delta by patches.
+    With ?encoding=deflate frames are sent zlib compressed as binary frames.
+    """
+    connectionController = ConnectionController.get_instance()
+    connection = await connectionController.accept(websocket, delta=protocol == "delta", deflate=encoding == "deflate", multiplexed=True)
+    await connectionController.listen(connection, load_snapshot=Broadcaster.get_instance().snapshot)
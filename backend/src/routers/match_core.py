@@ -1,24 +1,24 @@
 from fastapi import APIRouter,Depends
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from src.database.database import Database
 from src.controllers.match_core import MatchController
 from src.repositories.match_core import MatchRepository
 from src.repositories.team import TeamRepository
-from src.schemas.match_results import BatchCreateMatchResultsRequest, MatchResultsConcatStrict, GetMatchResultsResponse, UpdateMatchResultRequest, DeleteMatchResultRequest
+from src.schemas.match_results import BatchCreateMatchResultsRequest, UpdateMatchResultRequest, DeleteMatchResultRequest
 from fastapi import HTTPException
-from src.redis.lock import DistributedLock, MATCH_LOCK_KEY
-from config import Settings
+from src.redis.lock import MatchLock
 from fastapi import Request
 from src.schemas.user import UserRole
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
 from src.controllers.connection_controller import ConnectionController
-from typing import List
+from src.controllers.topic_state import valid_topic
+from src.middleware.middleware import get_user_session
 import logging
 match_router = APIRouter()
 database = Database.get_instance()
 
-@match_router.post("/match_results", tags=["match"])
+@match_router.post("/match_results", tags=["match"], dependencies=[Depends(get_user_session)])
 async def create_match_results(request: Request, batchRequest: BatchCreateMatchResultsRequest, db: AsyncSession = Depends(database.get_session)):
     """
     API endpoint to create teams in batch.
@@ -28,7 +28,8 @@ async def create_match_results(request: Request, batchRequest: BatchCreateMatchR
     match_results_controller = MatchController(
         match_repository=MatchRepository(db),
         team_repository=TeamRepository(db),
-        match_result_lock=DistributedLock(MATCH_LOCK_KEY)
+        # batches can outlive the lock ttl, keep the lease alive until the commit is done
+        match_result_lock=MatchLock(renew=True)
     )
     try:
         is_ok = await match_results_controller.create_results(
@@ -51,36 +52,32 @@ async def get_match_rankings(request: Request, round_number: int = None, group_n
     API endpoint to get all match results.
     """
     if round_number is None:
-        return HTTPException(status_code=400, detail="Round number is required")
+        return JSONResponse(content={"detail":"Round number is required"}, status_code=400)
     elif round_number < 1 or round_number > 3:
-        return HTTPException(status_code=400, detail="Round number should be between 1 and 3 inclusive")
-    match_results_controller = MatchController(
-        match_repository=MatchRepository(db),
-        team_repository=TeamRepository(db),
-        match_result_lock=DistributedLock(MATCH_LOCK_KEY)
-    )
-    match_results = await match_results_controller.get_match_rankings(qualifying_count = 4 ,round_number=round_number, group_number_filter=group_number)
-    return JSONResponse(content=match_results.dict(), status_code=200)
+        return JSONResponse(content={"detail":"Round number should be between 1 and 3 inclusive"}, status_code=400)
+    # checked before the cache, every group number asked for would get its own entry and database query
+    elif group_number is not None and not valid_topic(("match_rankings",round_number,group_number)):
+        return JSONResponse(content={"detail":"Group number is not a group of the tournament"}, status_code=400)
+    # rendered once per data version and shared by every worker, see ReadCache
+    return Response(content=await MatchController.rankings_message(db, round_number, group_number), media_type="application/json", status_code=200)
 
 @match_router.get("/match_results", tags=["match"])
 async def get_match_results(request: Request, round_number: int, db: AsyncSession = Depends(database.get_session)):
     """
     API endpoint to get match results by round number and group number.
     """
-    match_results_controller = MatchController(
-        match_repository=MatchRepository(db)
-    )
-    match_results: List[MatchResultsConcatStrict] = await match_results_controller.get_concat_match_results(round_number=round_number)
-    return JSONResponse(content=GetMatchResultsResponse(match_results=match_results).dict(), status_code=200)
+    if not valid_topic(("match_results",round_number)):
+        return JSONResponse(content={"detail":"Round number should be between 1 and 3 inclusive"}, status_code=400)
+    return Response(content=await MatchController.results_message(db, round_number), media_type="application/json", status_code=200)
 
-@match_router.put("/match_results", tags=["match"])
+@match_router.put("/match_results", tags=["match"], dependencies=[Depends(get_user_session)])
 async def update_match_result(request: Request, updateRequest: UpdateMatchResultRequest, db: AsyncSession = Depends(database.get_session)):
     if request.state.user_session is None or request.state.user_session.user_role != UserRole.admin:
         return HTTPException(status_code=401, detail="Unauthorized")
     match_results_controller = MatchController(
         match_repository=MatchRepository(db),
         team_repository=TeamRepository(db),
-        match_result_lock=DistributedLock(MATCH_LOCK_KEY)
+        match_result_lock=MatchLock()
     )
     try:
         is_ok = await match_results_controller.update_match_results_for_match_id(
@@ -95,20 +92,24 @@ async def update_match_result(request: Request, updateRequest: UpdateMatchResult
         else:
             logging.error(f"{request.state.user_session.user_role} action: Match result update failed")
             return JSONResponse(content={"detail":"match result update failed"}, status_code=500)
+    except HTTPException as e:
+        # eg. the match is not in the round given
+        logging.error(f"{request.state.user_session.user_role} action: Error updating match result: {e.detail}")
+        return JSONResponse(content={"detail":e.detail}, status_code=e.status_code)
     except Exception as e:
         logging.error(f"{request.state.user_session.user_role} action: Error updating match result: {e}")
         return JSONResponse(content={"detail":"match result update failed"}, status_code=500)
     
     
 
-@match_router.delete("/match_results", tags=["match"])
+@match_router.delete("/match_results", tags=["match"], dependencies=[Depends(get_user_session)])
 async def delete_match_result(request: Request, deleteRequest: DeleteMatchResultRequest, db: AsyncSession = Depends(database.get_session)):
     if request.state.user_session is None or request.state.user_session.user_role != UserRole.admin:
         return HTTPException(status_code=401, detail="Unauthorized")
     match_results_controller = MatchController(
         match_repository=MatchRepository(db),
         team_repository=TeamRepository(db),
-        match_result_lock=DistributedLock(MATCH_LOCK_KEY)
+        match_result_lock=MatchLock()
     )
     try:
         is_ok = await match_results_controller.delete_match(
@@ -121,27 +122,43 @@ async def delete_match_result(request: Request, deleteRequest: DeleteMatchResult
         else:
             logging.error(f"{request.state.user_session.user_role} action: Match result deletion failed")
             return JSONResponse(content={"detail":"match result deletion failed"}, status_code=500)
+    except HTTPException as e:
+        logging.error(f"{request.state.user_session.user_role} action: Error deleting match result: {e.detail}")
+        return JSONResponse(content={"detail":e.detail}, status_code=e.status_code)
     except Exception as e:
         logging.error(f"{request.state.user_session.user_role} action: Error deleting match result: {e}")
         return JSONResponse(content={"detail":"match result deletion failed"}, status_code=500)
 
 
 @match_router.websocket("/ws/match_rankings/{round}/{group}")
-async def websocket_endpoint(websocket: WebSocket, round: int, group: int):
+async def websocket_endpoint(websocket: WebSocket, round: int, group: int, protocol: str = "snapshot", encoding: str = "text"):
+    """
+    Pushes the group's rankings after every write, as full snapshots or with ?protocol=delta as a snapshot followed by patches.
+    With ?encoding=deflate frames are sent zlib compressed as binary frames.
+    """
+    async def load_snapshot() -> bytes:
+        async with database.SessionLocal() as db:
+            return await MatchController.rankings_message(db, round, group)
+    if not valid_topic(("match_rankings",round,group)):
+        # only the tournament's rounds and groups, each topic costs a subscription and snapshots
+        await websocket.close(code=1008)
+        return
     connectionController = ConnectionController.get_instance()
-    await connectionController.connect(("match_rankings",round,group),websocket)
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        connectionController.disconnect(("match_rankings",round,group),websocket)
+    connection = await connectionController.connect(("match_rankings",round,group),websocket, delta=protocol == "delta", load_snapshot=load_snapshot, deflate=encoding == "deflate")
+    await connectionController.listen(connection)
 
 @match_router.websocket("/ws/match_results/{round}")
-async def websocket_endpoint(websocket: WebSocket, round: int):
+async def websocket_endpoint(websocket: WebSocket, round: int, protocol: str = "snapshot", encoding: str = "text"):
+    """
+    Pushes the round's match results after every write, as full snapshots or with ?protocol=delta as a snapshot followed by patches.
+    With ?encoding=deflate frames are sent zlib compressed as binary frames.
+    """
+    async def load_snapshot() -> bytes:
+        async with database.SessionLocal() as db:
+            return await MatchController.results_message(db, round)
+    if not valid_topic(("match_results",round)):
+        await websocket.close(code=1008)
+        return
     connectionController = ConnectionController.get_instance()
-    await connectionController.connect(("match_results",round),websocket)
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        connectionController.disconnect(("match_results",round),websocket)
\ No newline at end of file
+    connection = await connectionController.connect(("match_results",round),websocket, delta=protocol == "delta", load_snapshot=load_snapshot, deflate=encoding == "deflate")
+    await connectionController.listen(connection)
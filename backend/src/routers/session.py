@@ -6,16 +6,28 @@ from src.controllers.authentication import AuthController
 from src.repositories.user import UserRepository
 from src.schemas.user import SessionTokenAndUserSession
 from fastapi import Request
+from src.middleware.middleware import get_user_session
+from src.redis.rate_limit import LoginRateLimiter
+from src.utils.crypto import BcryptPool
+from src.utils.metrics import Metrics
+from fastapi import HTTPException
 import logging
 session_router = APIRouter()
 database = Database.get_instance()
 session_storage = SessionStorage.get_instance()
+login_rate_limiter = LoginRateLimiter.get_instance()
 
 @session_router.post("/sessions", tags=["session"])
-async def create_session(user: UserLoginRequest, response: Response, db = Depends(database.get_session)):
+async def create_session(user: UserLoginRequest, request: Request, response: Response, db = Depends(database.get_session)):
     """
     API endpoint to create session.
+
+    Attempts are rate limited and admitted before the user lookup, so rejections never reach the database or bcrypt.
     """
+    await login_rate_limiter.check(user.username, request.client.host if request.client else None)
+    if BcryptPool.get_instance().is_saturated():
+        Metrics.get_instance().increment("login_admission_rejected")
+        raise HTTPException(status_code=429, detail="Too many logins in progress", headers={"Retry-After": "1"})
     auth_controller = AuthController(UserRepository(db), session_storage)
     cookie_ttl = 60 * 60 * 24
     session_token_and_user_session: SessionTokenAndUserSession = await auth_controller.create_session(username=user.username, password=user.password, ttl=cookie_ttl)
@@ -25,14 +37,14 @@ async def create_session(user: UserLoginRequest, response: Response, db = Depend
     return session_token_and_user_session.user_session
 
 
-@session_router.get("/sessions", tags=["session"])
+@session_router.get("/sessions", tags=["session"], dependencies=[Depends(get_user_session)])
 async def get_session_user(request: Request):
     """
     API endpoint to get session.
     """
     return request.state.user_session
 
-@session_router.delete("/sessions", tags=["session"])
+@session_router.delete("/sessions", tags=["session"], dependencies=[Depends(get_user_session)])
 async def delete_session(response: Response, request: Request):
     """
     API endpoint to delete session.
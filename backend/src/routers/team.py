@@ -5,18 +5,20 @@ from src.database.database import Database
 from src.repositories.team import TeamRepository
 from src.controllers.team import TeamController
 from src.schemas.team import BatchRegisterTeamRequest, TeamBase,TeamDetails, TeamUpdateRequest
-from src.redis.lock import DistributedLock, TEAM_LOCK_KEY, MATCH_LOCK_KEY
+from src.redis.lock import DistributedLock, MatchLock, TEAM_LOCK_KEY
 from typing import List
 from fastapi import HTTPException, Request
 from src.schemas.user import UserRole
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
 from src.controllers.connection_controller import ConnectionController
 from src.repositories.match_core import MatchRepository
+from src.redis.session import SessionStorage
+from src.middleware.middleware import get_user_session
 import logging
 team_router = APIRouter()
 database = Database.get_instance()
 
-@team_router.post("/teams", tags=["team"])
+@team_router.post("/teams", tags=["team"], dependencies=[Depends(get_user_session)])
 async def create_team(request:Request, batchRequest: BatchRegisterTeamRequest, db: AsyncSession = Depends(database.get_session)):
     """
     API endpoint to create teams in batch.
@@ -58,7 +60,7 @@ async def get_team(team_id: int, db: AsyncSession = Depends(database.get_session
         return JSONResponse(content={"detail":"team not found"}, status_code=404)
     return JSONResponse(content=team.dict(), status_code=200)
 
-@team_router.put("/teams/{team_id}", tags=["team"])
+@team_router.put("/teams/{team_id}", tags=["team"], dependencies=[Depends(get_user_session)])
 async def update_team(request: Request, team_id: int, team: TeamUpdateRequest, db: AsyncSession = Depends(database.get_session)):
     """
     API endpoint to update team by team ID.
@@ -78,14 +80,14 @@ async def update_team(request: Request, team_id: int, team: TeamUpdateRequest, d
         logging.error(f"{request.state.user_session.user_role} action: Error updating team: {e}")
         return JSONResponse(content={"detail":"team update failed"}, status_code=500)
 
-@team_router.delete("/teams/{team_id}", tags=["team"])
+@team_router.delete("/teams/{team_id}", tags=["team"], dependencies=[Depends(get_user_session)])
 async def delete_team(request: Request, team_id: int, db: AsyncSession = Depends(database.get_session)):
     """
     API endpoint to delete team by team ID.
     """
     if request.state.user_session is None or request.state.user_session.user_role != UserRole.admin:
         return HTTPException(status_code=401, detail="Unauthorized")
-    team_controller = TeamController(TeamRepository(db), MatchRepository(db), DistributedLock(TEAM_LOCK_KEY), DistributedLock(MATCH_LOCK_KEY))
+    team_controller = TeamController(TeamRepository(db), MatchRepository(db), DistributedLock(TEAM_LOCK_KEY), MatchLock(), SessionStorage.get_instance())
     try:
         is_ok = await team_controller.delete_team(team_id)
         if is_ok:
@@ -99,11 +101,14 @@ async def delete_team(request: Request, team_id: int, db: AsyncSession = Depends
         return JSONResponse(content={"detail":"team deletion failed"}, status_code=500)
 
 @team_router.websocket("/ws/teams")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, protocol: str = "snapshot", encoding: str = "text"):
+    """
+    Pushes the team list after every write, as full snapshots or with ?protocol=delta as a snapshot followed by patches.
+    With ?encoding=deflate frames are sent zlib compressed as binary frames.
+    """
+    async def load_snapshot() -> bytes:
+        async with database.SessionLocal() as db:
+            return await TeamController.teams_message(db)
     connectionController = ConnectionController.get_instance()
-    await connectionController.connect(("teams"),websocket)
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        connectionController.disconnect(("teams"),websocket)
+    connection = await connectionController.connect(("teams"),websocket, delta=protocol == "delta", load_snapshot=load_snapshot, deflate=encoding == "deflate")
+    await connectionController.listen(connection)
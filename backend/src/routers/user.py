@@ -7,12 +7,13 @@ from src.repositories.user import UserRepository
 from src.redis.lock import DistributedLock, USER_LOCK_KEY
 from src.schemas.user import UserRole
 from fastapi import Request
+from src.middleware.middleware import get_user_session
 import logging
 user_router = APIRouter()
 database = Database.get_instance()
 session_storage = SessionStorage.get_instance()
 
-@user_router.post("/users", tags=["user"])
+@user_router.post("/users", tags=["user"], dependencies=[Depends(get_user_session)])
 async def create_user(request:Request, user: UserCreateRequest, db = Depends(database.get_session)):
     """
     API endpoint to create users.
@@ -19,6 +19,12 @@ class MatchResultDetailed(BaseModel):
     goals_scored: int = Field(..., example=2, description="Number of goals scored by the team for the match")
     registration_day_of_year: int = Field(..., example=1609459200, description="Date when the team joined the tournament in Unix timestamp")
 
+class MatchResultScore(BaseModel):
+    round_number: int = Field(..., example=1, description="Round number for the match")
+    match_id: int = Field(..., example=1, description="Unique identifier for the match")
+    team_id: int = Field(..., example=1, description="Unique identifier for the team")
+    goals_scored: int = Field(..., example=2, description="Number of goals scored by the team for the match")
+
 class CreateMatchResults(BaseModel):
     # request body for creating a new match result
     result: List[MatchResultBase] = Field(..., example=[{"team_name": "Team A", "goals_scored": 2},{"team_name": "Team B", "goals_scored": 2}], description="List of team names and goals scored")
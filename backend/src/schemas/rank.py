@@ -13,6 +13,18 @@ class TeamRank(BaseModel):
     losses: int = Field(..., example=0, description="Number of losses by the team")
     registration_date_ddmm: str = Field(..., example='01/01', description="Date when the team joined the tournament in DD/MM")
     registration_day_of_year: int = Field(..., example=1609459200, description="Date when the team joined the tournament in Unix timestamp")
+
+class TeamStandingDetailed(BaseModel):
+    # a team's tally for a round as stored, not yet ranked
+    group_number: int = Field(..., example=1, description="Group number of the team")
+    team_id: int = Field(..., example=1, description="Unique identifier for the team")
+    team_name: str = Field(..., example='Team A', description="Name of the team")
+    registration_day_of_year: int = Field(..., example=1609459200, description="Date when the team joined the tournament in Unix timestamp")
+    goals: int = Field(..., example=5, description="Number of goals scored by the team")
+    wins: int = Field(..., example=2, description="Number of wins by the team")
+    draws: int = Field(..., example=1, description="Number of draws by the team")
+    losses: int = Field(..., example=0, description="Number of losses by the team")
+
 class GroupRanking(BaseModel):
     group_number: int = Field(..., example=1, description="Group number of the team")
     team_rankings: List[TeamRank] = Field(..., example=[{"position":1,"team_id":1,"team_name":"Team A","wins":2,"draws":1,"losses":0,"registration_date_ddmm":"01/01"}], description="List of team rankings in the group")
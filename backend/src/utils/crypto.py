@@ -1,4 +1,14 @@
 import bcrypt
+import base64
+import hashlib
+import hmac
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable
+from config import Settings
+from src.utils.metrics import Metrics
 
 def encrypt_password(password: str) -> str:
     """
@@ -13,4 +23,89 @@ def check_password(password: str, hashed_password: str) -> bool:
     """
     Checks if the password matches the hashed password
     """
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
\ No newline at end of file
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+class BcryptPool:
+    """
+    Bounded thread pool for bcrypt.
+
+    bcrypt releases the GIL, so hashes on the pool run in parallel with the event loop and with each other.
+    Hashes beyond PASSWORD_HASH_WORKERS wait in the pool queue, its depth and wait time are recorded in Metrics.
+    """
+    instance = None
+    def __init__(self, settings: Settings):
+        settings = settings.get_instance()
+        self.workers = settings.password_hash_workers
+        self.max_queue = settings.password_hash_max_queue
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = BcryptPool(Settings.get_instance())
+        return cls.instance
+
+    def is_saturated(self) -> bool:
+        """
+        is_saturated is true once max_queue hashes are waiting for a thread, new logins should be turned away rather than queued.
+        """
+        return self.in_flight - self.workers >= self.max_queue
+
+    async def run(self, func: Callable, *args):
+        metrics = Metrics.get_instance()
+        self.in_flight += 1
+        queue_depth = max(0, self.in_flight - self.workers)
+        metrics.set_gauge("password_hash_queue_depth", queue_depth)
+        metrics.observe("password_hash_queue_depth", queue_depth)
+        submitted_at = time.perf_counter()
+
+        def timed():
+            return time.perf_counter() - submitted_at, func(*args)
+
+        try:
+            queued_seconds, result = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+            metrics.observe("password_hash_queue_seconds", queued_seconds)
+            metrics.observe("password_hash_seconds", time.perf_counter() - submitted_at - queued_seconds)
+            return result
+        finally:
+            self.in_flight -= 1
+            metrics.set_gauge("password_hash_queue_depth", max(0, self.in_flight - self.workers))
+
+
+async def encrypt_password_async(password: str) -> str:
+    """
+    encrypt_password on the bcrypt thread pool, so hashing does not block the event loop
+    """
+    return await BcryptPool.get_instance().run(encrypt_password, password)
+
+
+async def check_password_async(password: str, hashed_password: str) -> bool:
+    """
+    check_password on the bcrypt thread pool, so verification does not block the event loop
+    """
+    return await BcryptPool.get_instance().run(check_password, password, hashed_password)
+
+
+def sign_token(payload: dict, key: str) -> str:
+    """
+    Signs the payload into a compact token: base64url(json payload).base64url(hmac-sha256)
+    """
+    body = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode('utf-8')).rstrip(b"=")
+    signature = base64.urlsafe_b64encode(hmac.new(key.encode('utf-8'), body, hashlib.sha256).digest()).rstrip(b"=")
+    return (body + b"." + signature).decode('utf-8')
+
+
+def verify_token(token: str, key: str) -> Optional[dict]:
+    """
+    Returns the payload of a token signed by sign_token, or None if the signature does not match
+    """
+    try:
+        body, signature = token.encode('utf-8').split(b".")
+        expected_signature = base64.urlsafe_b64encode(hmac.new(key.encode('utf-8'), body, hashlib.sha256).digest()).rstrip(b"=")
+        if not hmac.compare_digest(signature, expected_signature):
+            return None
+        return json.loads(base64.urlsafe_b64decode(body + b"=" * (-len(body) % 4)))
+    except (ValueError, UnicodeError):
+        return None
@@ -0,0 +1,53 @@
+import json
+import zlib
+from typing import Any
+
+try:
+    import orjson
+except ImportError: # optional, the standard library encoder is used without it
+    orjson = None
+
+def dumps(value: Any) -> bytes:
+    """
+    dumps serializes value to compact utf-8 JSON, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode('utf-8')
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Frame:
+    """
+    A websocket frame serialized once and shared by every subscriber it is sent to.
+
+    data is the utf-8 JSON as rendered and published, the text and deflated forms are derived on first use and cached on the frame,
+    so a frame costs one decode and at most one compression no matter how many sockets it goes out on.
+    """
+    __slots__ = ("data", "_text", "_deflated")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._text: str = None
+        self._deflated: bytes = None
+
+    @classmethod
+    def encode(cls, value: Any) -> "Frame":
+        return cls(dumps(value))
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode('utf-8')
+        return self._text
+
+    @property
+    def deflated(self) -> bytes:
+        # zlib format, clients inflate binary frames with DecompressionStream("deflate") or pako
+        if self._deflated is None:
+            self._deflated = zlib.compress(self.data)
+        return self._deflated
@@ -0,0 +1,40 @@
+from typing import Dict
+
+
+class Metrics:
+    """
+    In-process metrics registry.
+
+    Counters only go up, gauges hold the latest value, observations keep count/sum/max so averages and worst cases can be read off /metrics.
+    Values are per worker process.
+    """
+    instance = None
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.observations: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = Metrics()
+        return cls.instance
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        observation = self.observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        observation["count"] += 1
+        observation["sum"] += value
+        observation["max"] = max(observation["max"], value)
+
+    def snapshot(self) -> Dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "observations": {name: dict(observation) for name, observation in self.observations.items()},
+        }
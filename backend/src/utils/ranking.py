@@ -0,0 +1,66 @@
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError: # optional, rankings are computed in pure python without it
+    np = None
+
+# scoring rules, best first within each group:
+# 1. Highest total match points (3 points for win, 1 point for draw, 0 points for loss)
+# 2. Highest total goals scored
+# 3. Highest alternate total match points (5 points for win, 3 points for draw, 1 point for loss)
+# 4. Earliest registration date
+# teams equal on all four are tied and share the position of the last of them eg. 1, 3, 3 for a tie below first place,
+# teams positioned at or above qualifying_count qualify
+
+def rank_standings(group_numbers: Sequence[int], goals: Sequence[int], wins: Sequence[int], draws: Sequence[int], losses: Sequence[int], registration_days: Sequence[int], qualifying_count: int) -> Tuple[List[int], List[int], List[bool], List[bool]]:
+    """
+    rank_standings ranks the teams of every group at once from their standings, given as columns with one entry per team.
+
+    Returns:
+    order: List[int]: indexes of the teams by group number, best first within each group. fully tied teams keep their input order
+    positions: List[int], is_tied: List[bool], is_qualified: List[bool]: for the teams in order
+    """
+    if np is None:
+        return _rank_standings_python(group_numbers, goals, wins, draws, losses, registration_days, qualifying_count)
+    group_numbers = np.asarray(group_numbers, dtype=np.int64)
+    goals = np.asarray(goals, dtype=np.int64)
+    wins = np.asarray(wins, dtype=np.int64)
+    draws = np.asarray(draws, dtype=np.int64)
+    losses = np.asarray(losses, dtype=np.int64)
+    registration_days = np.asarray(registration_days, dtype=np.int64)
+    team_count = len(group_numbers)
+    if team_count == 0:
+        return [], [], [], []
+    points = wins * 3 + draws
+    alternate_points = wins * 5 + draws * 3 + losses
+    # lexsort is stable and sorts by the last key first
+    order = np.lexsort((registration_days, -alternate_points, -goals, -points, group_numbers))
+    keys = np.stack((group_numbers, points, goals, alternate_points, registration_days))[:, order]
+    tied_with_next = np.append(np.all(keys[:, 1:] == keys[:, :-1], axis=0), False)
+    is_tied = tied_with_next | np.insert(tied_with_next[:-1], 0, False)
+    indexes = np.arange(team_count)
+    # every team takes the position of the last team of its tie, counted from the first team of its group
+    tie_ends = np.flatnonzero(~tied_with_next)
+    group_starts = np.flatnonzero(np.insert(keys[0, 1:] != keys[0, :-1], 0, True))
+    positions = tie_ends[np.searchsorted(tie_ends, indexes)] - group_starts[np.searchsorted(group_starts, indexes, side="right") - 1] + 1
+    return order.tolist(), positions.tolist(), is_tied.tolist(), (positions <= qualifying_count).tolist()
+
+def _rank_standings_python(group_numbers: Sequence[int], goals: Sequence[int], wins: Sequence[int], draws: Sequence[int], losses: Sequence[int], registration_days: Sequence[int], qualifying_count: int) -> Tuple[List[int], List[int], List[bool], List[bool]]:
+    points = [win * 3 + draw for win, draw in zip(wins, draws)]
+    alternate_points = [win * 5 + draw * 3 + loss for win, draw, loss in zip(wins, draws, losses)]
+    keys = [(group_numbers[i], -points[i], -goals[i], -alternate_points[i], registration_days[i]) for i in range(len(group_numbers))]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    positions = [0] * len(order)
+    is_tied = [False] * len(order)
+    group_start = 0
+    for i in range(len(order)):
+        if i > 0 and keys[order[i]][0] != keys[order[i - 1]][0]:
+            group_start = i
+        positions[i] = i - group_start + 1
+    # from the bottom, so a tie takes the position of its last team
+    for i in range(len(order) - 2, -1, -1):
+        if keys[order[i]] == keys[order[i + 1]]:
+            is_tied[i] = is_tied[i + 1] = True
+            positions[i] = positions[i + 1]
+    return order, positions, is_tied, [position <= qualifying_count for position in positions]
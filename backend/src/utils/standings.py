@@ -0,0 +1,28 @@
+from typing import Dict, Iterable, List, Tuple
+from src.models.team_standing import TeamStanding
+from src.schemas.match_results import MatchResultScore
+
+def standing_deltas(added: Iterable[MatchResultScore] = (), removed: Iterable[MatchResultScore] = ()) -> List[TeamStanding]:
+    """
+    standing_deltas tallies what the matches in added add to each team's standing and the matches in removed take away, per round and team.
+
+    Both results of a match have to be given, a match with only one of them is skipped. Teams left unchanged get no delta.
+    """
+    deltas: Dict[Tuple[int, int], TeamStanding] = {} # (round_number, team_id) -> delta
+    for scores, sign in ((added, 1), (removed, -1)):
+        match_maker: Dict[int, MatchResultScore] = {} # match_id -> first result seen
+        for score in scores:
+            opponent = match_maker.pop(score.match_id, None)
+            if opponent is None:
+                match_maker[score.match_id] = score
+                continue
+            for team, other in ((score, opponent), (opponent, score)):
+                delta = deltas.setdefault((team.round_number, team.team_id), TeamStanding(round_number=team.round_number, team_id=team.team_id, goals=0, wins=0, draws=0, losses=0))
+                delta.goals += sign * team.goals_scored
+                if team.goals_scored > other.goals_scored:
+                    delta.wins += sign
+                elif team.goals_scored < other.goals_scored:
+                    delta.losses += sign
+                else:
+                    delta.draws += sign
+    return [delta for delta in deltas.values() if delta.goals != 0 or delta.wins != 0 or delta.draws != 0 or delta.losses != 0]
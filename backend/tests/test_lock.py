@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from src.redis.lock import MatchLock, match_lock_key, MATCH_LOCK_ROUNDS, MATCH_LOCK_GROUPS
+
+
+def lock_keys(match_lock: MatchLock):
+    return [lock.lock_key for lock in match_lock.locks]
+
+
+def test_scopes_take_their_leaves_in_sorted_order():
+    assert lock_keys(MatchLock().scope(round_number=2, group_numbers=[2, 1, 2])) == [match_lock_key(2, 1), match_lock_key(2, 2)]
+    assert lock_keys(MatchLock().scope(round_number=3)) == [match_lock_key(3, group_number) for group_number in MATCH_LOCK_GROUPS]
+    assert lock_keys(MatchLock().scope(group_numbers=[2])) == [match_lock_key(round_number, 2) for round_number in MATCH_LOCK_ROUNDS]
+    # tournament scope until narrowed
+    assert lock_keys(MatchLock()) == sorted(match_lock_key(round_number, group_number) for round_number in MATCH_LOCK_ROUNDS for group_number in MATCH_LOCK_GROUPS)
+
+
+@pytest.mark.anyio
+async def test_overlapping_scopes_exclude_each_other_without_deadlock(fake_redis):
+    # writers naming the same groups in opposite orders, and wider scopes covering them
+    scopes = [dict(round_number=1, group_numbers=[1, 2]), dict(round_number=1, group_numbers=[2, 1]), dict(round_number=1), dict(group_numbers=[2]), dict()]
+    holders = {}
+    overlaps = []
+
+    async def write(scope: dict):
+        match_lock = MatchLock().scope(**scope)
+        for _ in range(5):
+            assert await match_lock.get(timeout_seconds=5, interval=0.05)
+            keys = lock_keys(match_lock)
+            overlaps.extend(key for key in keys if key in holders)
+            holders.update({key: scope for key in keys})
+            await asyncio.sleep(0.001)
+            for key in keys:
+                holders.pop(key)
+            assert await match_lock.give()
+
+    await asyncio.wait_for(asyncio.gather(*[write(scope) for scope in scopes]), 20)
+    assert overlaps == []
@@ -0,0 +1,10 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+
+@pytest.mark.parametrize("url", ["/match_rankings?round_number=1&group_number=3", "/match_rankings?round_number=1&group_number=0", "/match_rankings?round_number=4", "/match_results?round_number=4"])
+def test_match_reads_outside_the_tournament_are_rejected_before_the_cache(url):
+    # no redis or database is reachable, anything past the check would fail with a 500
+    response = TestClient(main.app).get(url)
+    assert response.status_code == 400
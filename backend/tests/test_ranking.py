@@ -0,0 +1,59 @@
+import random
+from typing import List
+import pytest
+from benchmarks.ranking_kernel import legacy_rankings
+from src.controllers.match_core import MatchController
+from src.utils import ranking
+from src.utils.ranking import rank_standings
+
+QUALIFYING_COUNT = 4
+
+
+@pytest.fixture(params=["numpy", "pure python"])
+def kernel(request, monkeypatch):
+    if request.param == "numpy":
+        if ranking.np is None:
+            pytest.skip("numpy is not installed")
+    else:
+        monkeypatch.setattr(ranking, "np", None)
+    return request.param
+
+
+class ColumnsRepository:
+    def __init__(self, rows: List[tuple]):
+        self.rows = rows
+
+    async def get_standing_columns(self, round_number: int, group_number_filter: int = None) -> List[tuple]:
+        return list(zip(*self.rows)) or [()] * 8
+
+
+def standing_rows(seed: int, team_count: int, group_count: int) -> List[tuple]:
+    # (group_number, team_id, team_name, registration_day_of_year, goals, wins, draws, losses) ordered by group as get_standing_columns returns them
+    # few distinct values, so most groups have ties on every rule
+    generator = random.Random(seed)
+    rows = [(generator.randint(1, group_count), team_id, f"Team {team_id}", generator.randint(1, 5), generator.randint(0, 4), generator.randint(0, 2), generator.randint(0, 2), generator.randint(0, 2)) for team_id in range(1, team_count + 1)]
+    return sorted(rows, key=lambda row: row[0])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("seed", range(50))
+async def test_rankings_match_the_legacy_ranking(kernel, seed):
+    rows = standing_rows(seed, team_count=1 + seed * 3, group_count=1 + seed % 4)
+    rankings = await MatchController(match_repository=ColumnsRepository(rows)).get_match_rankings(qualifying_count=QUALIFYING_COUNT, round_number=1)
+    assert rankings == legacy_rankings(rows)
+
+
+@pytest.mark.anyio
+async def test_rankings_without_teams_are_empty(kernel):
+    assert rank_standings([], [], [], [], [], [], QUALIFYING_COUNT) == ([], [], [], [])
+    rankings = await MatchController(match_repository=ColumnsRepository([])).get_match_rankings(qualifying_count=QUALIFYING_COUNT, round_number=1)
+    assert rankings.group_rankings == []
+
+
+def test_tied_teams_share_the_position_of_the_last_of_them(kernel):
+    # the second and third teams are equal on every rule
+    order, positions, is_tied, is_qualified = rank_standings([1, 1, 1, 1], [5, 3, 3, 1], [2, 1, 1, 0], [0, 1, 1, 0], [0, 0, 0, 2], [1, 2, 2, 3], 2)
+    assert order == [0, 1, 2, 3]
+    assert positions == [1, 3, 3, 4]
+    assert is_tied == [False, True, True, False]
+    assert is_qualified == [True, False, False, False]
@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from src.redis.session import SessionStorage
+from src.schemas.user import UserRole, UserSessionStoreValue
+
+
+def signed_storage() -> SessionStorage:
+    # one per worker, they share revocation state through redis only
+    session_storage = SessionStorage()
+    session_storage.session_mode = "signed"
+    session_storage.signing_key = "test-signing-key"
+    return session_storage
+
+
+async def wait_for_invalidation(session_storage: SessionStorage, cache_generation: int):
+    while session_storage.cache_generation == cache_generation:
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("revoke", ["session", "user", "team", "generation"])
+async def test_signed_session_revoked_on_another_worker_is_rejected_on_the_next_lookup(fake_redis, revoke):
+    worker, other_worker = signed_storage(), signed_storage()
+    user_session = UserSessionStoreValue(user_id=1, user_role=UserRole.player, team_id=2)
+    session_id = await other_worker.create_session(user_session)
+    # loads the revocation mirror and subscribes to invalidations
+    assert await worker.get_session(session_id) == user_session
+    cache_generation = worker.cache_generation
+    if revoke == "session":
+        await other_worker.delete_session(session_id)
+    elif revoke == "user":
+        await other_worker.delete_all_sessions_for_user(1)
+    elif revoke == "team":
+        await other_worker.delete_all_sessions_for_team(2)
+    else:
+        await other_worker.delete_all_sessions_except_admin()
+    await asyncio.wait_for(wait_for_invalidation(worker, cache_generation), 2)
+    assert await worker.get_session(session_id) is None
@@ -0,0 +1,163 @@
+import asyncio
+import random
+from typing import Dict, List, Tuple
+import pytest
+from src.controllers.broadcaster import Broadcaster
+from src.controllers.match_core import MatchController
+from src.models.team_standing import TeamStanding
+from src.redis.lock import MatchLock
+from src.schemas.match_results import MatchResultScore
+from src.schemas.rank import TeamStandingDetailed
+from src.utils.standings import standing_deltas
+
+ROUND_NUMBER = 1
+GROUP_NUMBER = 1
+
+
+class SnapshotDatabase:
+    # committed match results and standings of one round, every team in one group
+    def __init__(self, scores: Dict[Tuple[int, int], int]):
+        self.scores = dict(scores) # (match_id, team_id) -> goals_scored
+        self.standings: Dict[int, List[int]] = {} # team_id -> [goals, wins, draws, losses]
+        self.apply(standing_deltas(added=score_list(self.scores)))
+
+    def apply(self, deltas: List[TeamStanding]):
+        for delta in deltas:
+            standing = self.standings.setdefault(delta.team_id, [0, 0, 0, 0])
+            for i, amount in enumerate((delta.goals, delta.wins, delta.draws, delta.losses)):
+                standing[i] += amount
+
+
+def score_list(scores: Dict[Tuple[int, int], int]) -> List[MatchResultScore]:
+    return [MatchResultScore(round_number=ROUND_NUMBER, match_id=match_id, team_id=team_id, goals_scored=goals) for (match_id, team_id), goals in scores.items()]
+
+
+def detailed(team_id: int, standing: List[int]) -> TeamStandingDetailed:
+    return TeamStandingDetailed(group_number=GROUP_NUMBER, team_id=team_id, team_name=f"Team {team_id}", registration_day_of_year=1, goals=standing[0], wins=standing[1], draws=standing[2], losses=standing[3])
+
+
+class SnapshotMatchRepository:
+    """
+    The MatchRepository calls of a match write, against a SnapshotDatabase with InnoDB's REPEATABLE READ: reads see the committed
+    results as of the transaction's first read, the standings upsert adds onto the latest committed row.
+    """
+    def __init__(self, database: SnapshotDatabase, looked_up: asyncio.Barrier):
+        self.database = database
+        self.looked_up = looked_up
+        self.snapshot: Dict[Tuple[int, int], int] = None
+        self.writes: Dict[Tuple[int, int], int] = {}
+        self.deltas: List[TeamStanding] = []
+
+    def read(self) -> Dict[Tuple[int, int], int]:
+        if self.snapshot is None:
+            self.snapshot = dict(self.database.scores)
+        return {**self.snapshot, **self.writes}
+
+    async def get_round_and_group_numbers_by_match_id(self, match_id: int) -> Tuple[int, List[int]]:
+        self.read()
+        # both writers look the match up before either takes the lock
+        await self.looked_up.wait()
+        return ROUND_NUMBER, [GROUP_NUMBER]
+
+    async def get_match_scores(self, match_ids: List[int] = None, team_id: int = None) -> List[MatchResultScore]:
+        return [score for score in score_list(self.read()) if score.match_id in match_ids]
+
+    async def update_match_results_for_match_id(self, match_id: int, team_id: int, team_goals: int) -> bool:
+        self.writes[(match_id, team_id)] = team_goals
+        return True
+
+    async def add_to_standings(self, deltas: List[TeamStanding]) -> bool:
+        self.deltas.extend(deltas)
+        return True
+
+    async def commit_transaction(self) -> bool:
+        self.database.scores.update(self.writes)
+        self.database.apply(self.deltas)
+        return await self.rollback_transaction()
+
+    async def rollback_transaction(self) -> bool:
+        self.snapshot = None
+        self.writes = {}
+        self.deltas = []
+        return True
+
+    async def get_standings(self, round_number: int) -> List[TeamStandingDetailed]:
+        return [detailed(team_id, standing) for team_id, standing in sorted(self.database.standings.items())]
+
+    async def get_standings_aggregated(self, round_number: int) -> List[TeamStandingDetailed]:
+        database = SnapshotDatabase(self.database.scores)
+        return [detailed(team_id, standing) for team_id, standing in sorted(database.standings.items())]
+
+
+@pytest.mark.anyio
+async def test_concurrent_updates_to_one_match_keep_standings_in_step(fake_redis):
+    # match 1 between teams 1 and 2 drawn 1-1, corrected to 3-1 and then to 0-1 by two admins at once
+    database = SnapshotDatabase({(1, 1): 1, (1, 2): 1})
+    looked_up = asyncio.Barrier(2)
+    controllers = [MatchController(match_repository=SnapshotMatchRepository(database, looked_up), match_result_lock=MatchLock()) for _ in range(2)]
+    try:
+        await asyncio.gather(*[controller.update_match_results_for_match_id(ROUND_NUMBER, 1, 1, goals) for controller, goals in zip(controllers, (3, 0))])
+    finally:
+        await Broadcaster.get_instance().close()
+    assert await controllers[0].get_standings_drift(round_numbers=[ROUND_NUMBER]) == []
+
+
+def legacy_tally(scores: List[MatchResultScore]) -> Dict[Tuple[int, int], List[int]]:
+    # how get_match_rankings tallied the match results before standings were stored: (round_number, team_id) -> [goals, wins, draws, losses]
+    match_maker: Dict[int, MatchResultScore] = {}
+    tally: Dict[Tuple[int, int], List[int]] = {}
+    for score in scores:
+        if match_maker.get(score.match_id, None) is None:
+            match_maker[score.match_id] = score
+            continue
+        team_a, team_b = match_maker[score.match_id], score
+        for team, other in ((team_a, team_b), (team_b, team_a)):
+            standing = tally.setdefault((team.round_number, team.team_id), [0, 0, 0, 0])
+            standing[0] += team.goals_scored
+            if team.goals_scored > other.goals_scored:
+                standing[1] += 1
+            elif team.goals_scored == other.goals_scored:
+                standing[2] += 1
+            else:
+                standing[3] += 1
+    return tally
+
+
+def tallied(deltas: List[TeamStanding]) -> Dict[Tuple[int, int], List[int]]:
+    return {(delta.round_number, delta.team_id): [delta.goals, delta.wins, delta.draws, delta.losses] for delta in deltas}
+
+
+def random_scores(seed: int, match_count: int) -> List[MatchResultScore]:
+    generator = random.Random(seed)
+    scores = []
+    for match_id in range(1, match_count + 1):
+        round_number = generator.randint(1, 3)
+        team_ids = generator.sample(range(1, 13), 2)
+        # mostly low scores, so draws are common
+        scores.extend(MatchResultScore(round_number=round_number, match_id=match_id, team_id=team_id, goals_scored=generator.randint(0, 3)) for team_id in team_ids)
+    return scores
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_standing_deltas_match_the_legacy_tally(seed):
+    scores = random_scores(seed, match_count=seed * 2)
+    random.Random(seed).shuffle(scores)
+    assert tallied(standing_deltas(added=scores)) == legacy_tally(scores)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_standing_deltas_of_removed_matches_cancel_out(seed):
+    scores = random_scores(seed, match_count=1 + seed)
+    removed_match_ids = set(random.Random(seed).sample(range(1, 2 + seed), (1 + seed) // 2))
+    kept = [score for score in scores if score.match_id not in removed_match_ids]
+    removed = [score for score in scores if score.match_id in removed_match_ids]
+    standings = tallied(standing_deltas(added=scores))
+    for key, delta in tallied(standing_deltas(removed=removed)).items():
+        standings[key] = [amount + change for amount, change in zip(standings.get(key, [0, 0, 0, 0]), delta)]
+    # teams left with only removed matches drop to zero, the legacy tally has no entry for them
+    assert {key: standing for key, standing in standings.items() if any(standing)} == legacy_tally(kept)
+
+
+def test_standing_deltas_skip_matches_missing_a_result():
+    assert standing_deltas() == []
+    assert standing_deltas(added=[MatchResultScore(round_number=1, match_id=1, team_id=1, goals_scored=2)]) == []
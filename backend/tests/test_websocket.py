@@ -0,0 +1,24 @@
+import pytest
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.testclient import TestClient
+from config import Settings
+from src.controllers.connection_controller import ConnectionController
+
+
+def test_listen_ends_cleanly_once_the_server_closes_the_socket():
+    connection_controller = ConnectionController(Settings.get_instance())
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        connection = await connection_controller.accept(websocket, multiplexed=True)
+        # as the writer does when it drops a slow client
+        await websocket.close(code=1013)
+        await connection_controller.listen(connection)
+
+    # server errors are raised here by the test client
+    with TestClient(app).websocket_connect("/ws") as websocket:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_text()
+    assert closed.value.code == 1013
+    assert connection_controller.connections == {}